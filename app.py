@@ -3,9 +3,26 @@ import pandas as pd
 import sqlite3
 import datetime
 import plotly.express as px
-import plotly.graph_objects as go
-import numpy as np
-import io
+import os
+import gzip
+import tempfile
+import shutil
+import atexit
+import re
+import unicodedata
+import json
+import contextlib
+import concurrent.futures
+import queue
+import threading
+import time
+
+try:
+    # Parquet 导出为可选功能，未安装 pyarrow 时不提供该格式
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 
 # --- 配置与数据初始化 ---
 DB_FILE = 'crm_data.db'
@@ -13,6 +30,20 @@ PROMO_DB_FILE = 'promo_data.db'
 USER_DB_FILE = 'user_management.db'
 DAYS_FOR_TRANSFER = 20 
 
+# SQLite 连接参数：每个连接创建时设置一次，之后在进程内复用
+SQLITE_BUSY_TIMEOUT = 10.0  # 秒，写锁等待时间，避免 "database is locked"
+SQLITE_POOL_SIZE = 8
+# 迁移用到 ALTER TABLE ... DROP COLUMN，需要 SQLite 3.35 及以上；启动时检查一次
+MIN_SQLITE_VERSION = (3, 35, 0)
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",        # 读写并发：写入时不阻塞其他销售的读取
+    "PRAGMA synchronous=NORMAL",      # WAL 模式下足够安全，减少 fsync
+    "PRAGMA cache_size=-32000",       # 约 32MB 页缓存
+    "PRAGMA mmap_size=268435456",     # 256MB 内存映射读取
+    "PRAGMA temp_store=MEMORY",
+    f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT * 1000)}",
+)
+
 # 1. 初始用户账号配置
 INITIAL_USERS = {
     'admin': {'password': 'admin123', 'role': 'admin', 'display_name': '超级管理员'},
@@ -35,6 +66,7 @@ STATUS_OPTIONS = ["初次接触", "已寄样", "报价中", "合同流程", "施
 INTENT_OPTIONS = ["高", "中", "低", "已成交", "流失"]
 SOURCE_OPTIONS = ["自然进店", "拼多多推广", "天猫推广", "老客户转介绍", "其他"]
 PROMO_TYPE_OPTIONS = ["成交收费", "成交加扣", "其他"]
+CONSTRUCTION_OPTIONS = ["否", "是"]
 
 # 3. 英文到中文列名映射 (核心部分)
 CRM_COL_MAP = {
@@ -42,67 +74,366 @@ CRM_COL_MAP = {
     'phone': '联系电话', 'source': '客户来源', 'shop_name': '店铺名称', 'unit_price': '单价(元/㎡)',
     'area': '平方数(㎡)', 'site_type': '应用场地', 'status': '跟踪进度', 'is_construction': '是否施工',
     'construction_fee': '施工费(元)', 'material_fee': '辅料费(元)', 'shipping_fee': '运费(元)', 
-    'purchase_intent': '购买意向', 'total_amount': '预估总金额(元)', 'follow_up_history': '跟进历史',
+    'purchase_intent': '购买意向', 'total_amount': '预估总金额(元)', 'gross_margin': '毛利(元)',
+    'total_with_shipping': '实际含运费总额(元)', 'follow_up_history': '跟进历史',
     'sample_no': '寄样单号', 'order_no': '订单号', 'last_follow_up_date': '上次跟进日期', 
     'next_follow_up_date': '计划下次跟进'
 }
 
-# --- 数据库函数 (用户管理) ---
-def init_user_db():
-    conn = sqlite3.connect(USER_DB_FILE)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
+# 推广数据列名映射
+PROMO_COL_MAP = {
+    'id': 'ID', 'month': '月份', 'shop': '店铺', 'promo_type': '推广类型',
+    'total_spend': '总花费(元)', 'trans_spend': '成交花费(元)', 'net_gmv': '净成交额(元)',
+    'net_roi': '净投产比(ROI)', 'cpa_net': '每笔净成交花费(元)', 'inquiry_count': '询单量',
+    'inquiry_spend': '询单花费(元)', 'cpl': '询单成本(元/个)', 'note': '备注'
+}
+
+# --- 数据库连接池 ---
+class SQLitePool:
+    def __init__(self, db_file, max_size=SQLITE_POOL_SIZE):
+        self.db_file = db_file
+        self.max_size = max_size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # check_same_thread=False：Streamlit 每次 rerun 可能在不同线程执行，连接由池保证同一时刻只被一个线程使用
+        conn = sqlite3.connect(self.db_file, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_create = self._created < self.max_size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        # 池已满：等待其他线程归还连接
+        try:
+            return self._idle.get(timeout=SQLITE_BUSY_TIMEOUT)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f"连接池耗尽: {self.db_file}")
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+@st.cache_resource
+def get_db_pools():
+    # 进程级缓存：所有会话、所有 rerun 共享同一组连接
+    return {db_file: SQLitePool(db_file) for db_file in (DB_FILE, PROMO_DB_FILE, USER_DB_FILE)}
+
+@contextlib.contextmanager
+def db_conn(db_file):
+    # 借出连接；正常退出时提交，异常时回滚，最后归还连接池
+    pool = get_db_pools()[db_file]
+    conn = pool.acquire()
+    try:
+        yield conn
+        if conn.in_transaction:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.release(conn)
+
+# --- 数据库结构迁移 (基于 PRAGMA user_version) ---
+# 每个数据库一份有序迁移列表：执行完第 N 项后 user_version = N。
+# 已上线的迁移不要再修改，结构变更一律追加新项。迁移项可以是 SQL 脚本，也可以是接收连接的函数 (需要 Python 处理的数据迁移)。
+USER_DB_MIGRATIONS = [
+    # v1: 用户表
+    '''CREATE TABLE IF NOT EXISTS users (
         username TEXT PRIMARY KEY,
         password TEXT,
         role TEXT,
         display_name TEXT
-    )''')
-    conn.commit()
-    c.execute("SELECT COUNT(*) FROM users")
-    if c.fetchone()[0] == 0:
-        for username, data in INITIAL_USERS.items():
-            c.execute("INSERT INTO users VALUES (?, ?, ?, ?)", 
-                      (username, data['password'], data['role'], data['display_name']))
-        conn.commit()
-    conn.close()
-
-def get_all_users():
-    conn = sqlite3.connect(USER_DB_FILE)
-    df = pd.read_sql_query("SELECT username, role, display_name FROM users", conn)
-    conn.close()
-    return df
-
-def get_user_info(username):
-    conn = sqlite3.connect(USER_DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT password, role, display_name FROM users WHERE username=?", (username,))
-    result = c.fetchone()
-    conn.close()
-    if result:
-        return {'password': result[0], 'role': result[1], 'display_name': result[2]}
-    return None
-
-def add_new_user(username, password, role, display_name):
-    conn = sqlite3.connect(USER_DB_FILE)
-    c = conn.cursor()
-    try:
-        c.execute("INSERT INTO users VALUES (?, ?, ?, ?)", (username, password, role, display_name))
-        conn.commit()
-        conn.close()
-        return True
-    except sqlite3.IntegrityError:
-        conn.close()
-        return False
+    );''',
+]
 
-def get_user_map():
-    df = get_all_users()
-    return df.set_index('username')['display_name'].to_dict()
+# 旧版 follow_up_history 文本日志的条目头，例如 "[2024-05-01 李秋芳]: ..." 或 "[2024-05-01] 系统转交：..."
+_HISTORY_ENTRY_RE = re.compile(r'^\[([^\]]*)\]\s*:?\s*(.*)$')
+_HISTORY_DATE_RE = re.compile(r'^(\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2})?)?)\s*(.*)$')
+
+def parse_follow_up_history(history):
+    # 将换行拼接的历史文本拆成 [timestamp, author, text] 列表；不以 "[" 开头的行视为上一条的续行
+    entries = []
+    for line in (history or '').split('\n'):
+        if not line.strip():
+            continue
+        m = _HISTORY_ENTRY_RE.match(line.strip())
+        if m:
+            header, text = m.group(1).strip(), m.group(2)
+            dm = _HISTORY_DATE_RE.match(header)
+            if dm:
+                entries.append([dm.group(1), dm.group(2) or '系统', text])
+            else:
+                # 无日期的条目 (如 "[管理员修改]: ...")：时间未知，记为空而不是借用上一条的日期
+                entries.append([None, header, text])
+        elif entries:
+            entries[-1][2] += '\n' + line
+        else:
+            entries.append([None, '系统', line])
+    return entries
 
-# --- 数据库函数 (CRM 客户数据) ---
-def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS sales (
+def _migrate_follow_up_history(conn):
+    # 跟进历史从 sales 行内的长文本迁移到只追加的 follow_ups 表
+    conn.execute('''CREATE TABLE IF NOT EXISTS follow_ups (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        record_id INTEGER NOT NULL,
+        timestamp TEXT,
+        author TEXT,
+        text TEXT,
+        next_date TEXT,
+        status TEXT,
+        intent TEXT
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_follow_ups_record ON follow_ups(record_id, id)")
+    rows = conn.execute("SELECT id, follow_up_history FROM sales WHERE follow_up_history IS NOT NULL AND follow_up_history != '' ORDER BY id").fetchall()
+    conn.executemany(
+        "INSERT INTO follow_ups (record_id, timestamp, author, text) VALUES (?, ?, ?, ?)",
+        ((record_id, ts, author, text) for record_id, history in rows for ts, author, text in parse_follow_up_history(history)))
+    conn.execute("ALTER TABLE sales DROP COLUMN follow_up_history")
+
+# 查重用的规范化键：电话只保留数字 (去掉 +86 前缀)，客户名去掉所有空白、全角转半角、统一大小写
+_PHONE_NON_DIGIT_RE = re.compile(r'[^0-9]')
+_PHONE_COUNTRY_RE = re.compile(r'^86(?=\d{11}$)')
+_NAME_SPACE_RE = re.compile(r'\s+')
+
+def normalize_phone(phone):
+    digits = _PHONE_NON_DIGIT_RE.sub('', unicodedata.normalize('NFKC', str(phone or '')))
+    return _PHONE_COUNTRY_RE.sub('', digits)
+
+def normalize_name(name):
+    return _NAME_SPACE_RE.sub('', unicodedata.normalize('NFKC', str(name or ''))).casefold()
+
+def normalize_phones(phones):
+    # 整列版本，与 normalize_phone 结果一致
+    phones = pd.Series(phones, dtype=object).fillna('').astype(str).str.normalize('NFKC')
+    return phones.str.replace(_PHONE_NON_DIGIT_RE, '', regex=True).str.replace(_PHONE_COUNTRY_RE, '', regex=True)
+
+def normalize_names(names):
+    names = pd.Series(names, dtype=object).fillna('').astype(str).str.normalize('NFKC')
+    return names.str.replace(_NAME_SPACE_RE, '', regex=True).str.casefold()
+
+def _migrate_customer_keys(conn):
+    conn.execute("ALTER TABLE sales ADD COLUMN name_norm TEXT NOT NULL DEFAULT ''")
+    conn.execute("ALTER TABLE sales ADD COLUMN phone_norm TEXT NOT NULL DEFAULT ''")
+    rows = conn.execute("SELECT id, customer_name, phone FROM sales").fetchall()
+    if rows:
+        ids, names, phones = zip(*rows)
+        conn.executemany("UPDATE sales SET name_norm = ?, phone_norm = ? WHERE id = ?",
+                         zip(normalize_names(names).tolist(), normalize_phones(phones).tolist(), ids))
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sales_name_norm ON sales(name_norm)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sales_phone_norm ON sales(phone_norm)")
+    conn.execute("ANALYZE sales")
+
+# 月度汇总表：按 (月份, 对接人, 店铺, 场地, 进度, 来源) 累计线索数、销售额(不含运费)、毛利、面积、运费，由触发器实时维护
+ROLLUP_KEY_COLS = ['month', 'sales_rep', 'shop_name', 'site_type', 'status', 'source']
+ROLLUP_MEASURE_COLS = ['lead_count', 'revenue', 'gross_margin', 'area', 'shipping']
+# 影响汇总结果的 sales 列；只改了其他列 (如跟进日期) 时不触发汇总更新
+# v5 上线时的列表，保持不变；v11 把 total_amount 改为生成列后，更新触发器改为监听 unit_price (见 _migrate_derived_amounts)
+ROLLUP_SOURCE_COLS = ['date', 'sales_rep', 'shop_name', 'site_type', 'status', 'source',
+                      'total_amount', 'construction_fee', 'material_fee', 'area', 'shipping_fee']
+
+def _rollup_key_sql(row):
+    # row 为 'NEW' / 'OLD' / 表别名；非法日期归入空月份，空值统一为空串以保证主键唯一
+    return ", ".join([
+        f"CASE WHEN {row}.date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]*' THEN substr({row}.date, 1, 7) ELSE '' END",
+        *(f"COALESCE({row}.{col}, '')" for col in ROLLUP_KEY_COLS[1:]),
+    ])
+
+def _rollup_measure_exprs(row):
+    # 与 ROLLUP_MEASURE_COLS 一一对应；空值按 0 计，毛利 = 销售额(不含运费) - 施工费 - 辅料费
+    return [
+        "1",
+        f"COALESCE({row}.total_amount, 0)",
+        f"COALESCE({row}.total_amount, 0) - COALESCE({row}.construction_fee, 0) - COALESCE({row}.material_fee, 0)",
+        f"COALESCE({row}.area, 0)",
+        f"COALESCE({row}.shipping_fee, 0)",
+    ]
+
+def _rollup_measure_sql(row, sign=''):
+    return ", ".join(f"{sign}({expr})" for expr in _rollup_measure_exprs(row))
+
+def _rollup_upsert_sql(row, sign=''):
+    keys = ", ".join(ROLLUP_KEY_COLS)
+    updates = ", ".join(f"{col} = {col} + excluded.{col}" for col in ROLLUP_MEASURE_COLS)
+    return (f"INSERT INTO sales_monthly_rollup ({keys}, {', '.join(ROLLUP_MEASURE_COLS)}) "
+            f"VALUES ({_rollup_key_sql(row)}, {_rollup_measure_sql(row, sign)}) "
+            f"ON CONFLICT ({keys}) DO UPDATE SET {updates};")
+
+def _rollup_cleanup_sql(row):
+    return (f"DELETE FROM sales_monthly_rollup WHERE ({', '.join(ROLLUP_KEY_COLS)}) = ({_rollup_key_sql(row)}) "
+            f"AND lead_count <= 0;")
+
+ROLLUP_REBUILD_SQL = f"""
+    DELETE FROM sales_monthly_rollup;
+    INSERT INTO sales_monthly_rollup ({', '.join(ROLLUP_KEY_COLS + ROLLUP_MEASURE_COLS)})
+    SELECT {_rollup_key_sql('s')}, {', '.join(f'SUM({expr})' for expr in _rollup_measure_exprs('s'))}
+    FROM sales s
+    GROUP BY {', '.join(str(i + 1) for i in range(len(ROLLUP_KEY_COLS)))};
+"""
+
+def _sales_rollup_sql(source_cols):
+    return f"""
+    CREATE TABLE IF NOT EXISTS sales_monthly_rollup (
+        month TEXT NOT NULL,
+        sales_rep TEXT NOT NULL,
+        shop_name TEXT NOT NULL,
+        site_type TEXT NOT NULL,
+        status TEXT NOT NULL,
+        source TEXT NOT NULL,
+        lead_count INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0,
+        gross_margin REAL NOT NULL DEFAULT 0,
+        area REAL NOT NULL DEFAULT 0,
+        shipping REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY ({', '.join(ROLLUP_KEY_COLS)})
+    ) WITHOUT ROWID;
+    CREATE TRIGGER IF NOT EXISTS trg_sales_rollup_insert AFTER INSERT ON sales
+    BEGIN
+        {_rollup_upsert_sql('NEW')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_sales_rollup_delete AFTER DELETE ON sales
+    BEGIN
+        {_rollup_upsert_sql('OLD', '-')}
+        {_rollup_cleanup_sql('OLD')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_sales_rollup_update AFTER UPDATE OF {', '.join(source_cols)} ON sales
+    BEGIN
+        {_rollup_upsert_sql('OLD', '-')}
+        {_rollup_upsert_sql('NEW')}
+        {_rollup_cleanup_sql('OLD')}
+    END;
+    {ROLLUP_REBUILD_SQL}
+"""
+
+SALES_ROLLUP_SQL = _sales_rollup_sql(ROLLUP_SOURCE_COLS)
+
+# 全文检索：trigram 分词支持中文客户名和电话号码片段；外部内容表不重复存储原文，由触发器同步
+SALES_FTS_COLS = ['customer_name', 'phone', 'shop_name', 'order_no', 'sample_no']
+
+def _fts_values(row):
+    return ", ".join(f"{row}.{col}" for col in SALES_FTS_COLS)
+
+SALES_FTS_SQL = f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS sales_fts USING fts5(
+        {', '.join(SALES_FTS_COLS)}, content='sales', content_rowid='id', tokenize='trigram');
+    CREATE VIRTUAL TABLE IF NOT EXISTS follow_ups_fts USING fts5(
+        text, content='follow_ups', content_rowid='id', tokenize='trigram');
+    CREATE TRIGGER IF NOT EXISTS trg_sales_fts_insert AFTER INSERT ON sales
+    BEGIN
+        INSERT INTO sales_fts (rowid, {', '.join(SALES_FTS_COLS)}) VALUES (NEW.id, {_fts_values('NEW')});
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_sales_fts_delete AFTER DELETE ON sales
+    BEGIN
+        INSERT INTO sales_fts (sales_fts, rowid, {', '.join(SALES_FTS_COLS)}) VALUES ('delete', OLD.id, {_fts_values('OLD')});
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_sales_fts_update AFTER UPDATE OF {', '.join(SALES_FTS_COLS)} ON sales
+    BEGIN
+        INSERT INTO sales_fts (sales_fts, rowid, {', '.join(SALES_FTS_COLS)}) VALUES ('delete', OLD.id, {_fts_values('OLD')});
+        INSERT INTO sales_fts (rowid, {', '.join(SALES_FTS_COLS)}) VALUES (NEW.id, {_fts_values('NEW')});
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_follow_ups_fts_insert AFTER INSERT ON follow_ups
+    BEGIN
+        INSERT INTO follow_ups_fts (rowid, text) VALUES (NEW.id, NEW.text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_follow_ups_fts_delete AFTER DELETE ON follow_ups
+    BEGIN
+        INSERT INTO follow_ups_fts (follow_ups_fts, rowid, text) VALUES ('delete', OLD.id, OLD.text);
+    END;
+    INSERT INTO sales_fts (sales_fts) VALUES ('rebuild');
+    INSERT INTO follow_ups_fts (follow_ups_fts) VALUES ('rebuild');
+"""
+
+# v14 的搜索索引：索引内容来自视图，每个值末尾补两个空格 —— 1~2 个字符的词在值中的每处出现都是某个三字词元的开头，
+# 可以通过词表 (fts5vocab) 按前缀找到这些词元再查索引，不必扫描全表
+FTS_PAD_SQL = "{value} || '  '"
+
+def _padded_fts_values(row, cols):
+    return ", ".join(FTS_PAD_SQL.format(value=f"{row}.{col}") for col in cols)
+
+SEARCH_FTS_PADDED_SQL = f"""
+    DROP TRIGGER IF EXISTS trg_sales_fts_insert;
+    DROP TRIGGER IF EXISTS trg_sales_fts_delete;
+    DROP TRIGGER IF EXISTS trg_sales_fts_update;
+    DROP TRIGGER IF EXISTS trg_follow_ups_fts_insert;
+    DROP TRIGGER IF EXISTS trg_follow_ups_fts_delete;
+    DROP TABLE IF EXISTS sales_fts;
+    DROP TABLE IF EXISTS follow_ups_fts;
+    CREATE VIEW IF NOT EXISTS sales_fts_source AS
+        SELECT id, {', '.join(f"{FTS_PAD_SQL.format(value=col)} AS {col}" for col in SALES_FTS_COLS)} FROM sales;
+    CREATE VIEW IF NOT EXISTS follow_ups_fts_source AS
+        SELECT id, {FTS_PAD_SQL.format(value='text')} AS text FROM follow_ups;
+    CREATE VIRTUAL TABLE sales_fts USING fts5(
+        {', '.join(SALES_FTS_COLS)}, content='sales_fts_source', content_rowid='id', tokenize='trigram');
+    CREATE VIRTUAL TABLE follow_ups_fts USING fts5(
+        text, content='follow_ups_fts_source', content_rowid='id', tokenize='trigram');
+    CREATE VIRTUAL TABLE IF NOT EXISTS sales_fts_vocab USING fts5vocab(sales_fts, 'row');
+    CREATE VIRTUAL TABLE IF NOT EXISTS follow_ups_fts_vocab USING fts5vocab(follow_ups_fts, 'row');
+    CREATE TRIGGER trg_sales_fts_insert AFTER INSERT ON sales
+    BEGIN
+        INSERT INTO sales_fts (rowid, {', '.join(SALES_FTS_COLS)}) VALUES (NEW.id, {_padded_fts_values('NEW', SALES_FTS_COLS)});
+    END;
+    CREATE TRIGGER trg_sales_fts_delete AFTER DELETE ON sales
+    BEGIN
+        INSERT INTO sales_fts (sales_fts, rowid, {', '.join(SALES_FTS_COLS)}) VALUES ('delete', OLD.id, {_padded_fts_values('OLD', SALES_FTS_COLS)});
+    END;
+    CREATE TRIGGER trg_sales_fts_update AFTER UPDATE OF {', '.join(SALES_FTS_COLS)} ON sales
+    BEGIN
+        INSERT INTO sales_fts (sales_fts, rowid, {', '.join(SALES_FTS_COLS)}) VALUES ('delete', OLD.id, {_padded_fts_values('OLD', SALES_FTS_COLS)});
+        INSERT INTO sales_fts (rowid, {', '.join(SALES_FTS_COLS)}) VALUES (NEW.id, {_padded_fts_values('NEW', SALES_FTS_COLS)});
+    END;
+    CREATE TRIGGER trg_follow_ups_fts_insert AFTER INSERT ON follow_ups
+    BEGIN
+        INSERT INTO follow_ups_fts (rowid, text) VALUES (NEW.id, {_padded_fts_values('NEW', ['text'])});
+    END;
+    CREATE TRIGGER trg_follow_ups_fts_delete AFTER DELETE ON follow_ups
+    BEGIN
+        INSERT INTO follow_ups_fts (follow_ups_fts, rowid, text) VALUES ('delete', OLD.id, {_padded_fts_values('OLD', ['text'])});
+    END;
+    INSERT INTO sales_fts (sales_fts) VALUES ('rebuild');
+    INSERT INTO follow_ups_fts (follow_ups_fts) VALUES ('rebuild');
+"""
+
+# 派生金额列：由数据库按公式计算 (VIRTUAL 生成列，不占存储、可建索引)，写入方不再各自计算
+SALES_DERIVED_SQL = {
+    # 🚨 预估总金额不含运费
+    'total_amount': "COALESCE(unit_price, 0) * COALESCE(area, 0) + COALESCE(construction_fee, 0) + COALESCE(material_fee, 0)",
+    'gross_margin': "total_amount - COALESCE(construction_fee, 0) - COALESCE(material_fee, 0)",
+    'total_with_shipping': "total_amount + COALESCE(shipping_fee, 0)",
+}
+SALES_DERIVED_COLS = list(SALES_DERIVED_SQL)
+
+def _migrate_derived_amounts(conn):
+    # 已存储的 total_amount 换成生成列；汇总触发器引用了该列，需先删除，换列后重建并重算汇总表
+    for trigger in ('trg_sales_rollup_insert', 'trg_sales_rollup_delete', 'trg_sales_rollup_update'):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("ALTER TABLE sales DROP COLUMN total_amount")
+    for col, expr in SALES_DERIVED_SQL.items():
+        conn.execute(f"ALTER TABLE sales ADD COLUMN {col} REAL GENERATED ALWAYS AS ({expr}) VIRTUAL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sales_total_amount ON sales(total_amount)")
+    # 生成列不会被 UPDATE 直接修改，更新触发器改为监听计算 total_amount 用到的 unit_price
+    source_cols = [col for col in ROLLUP_SOURCE_COLS if col != 'total_amount'] + ['unit_price']
+    _execute_script(conn, _sales_rollup_sql(source_cols))
+
+SALES_DB_MIGRATIONS = [
+    # v1: 客户销售表
+    '''CREATE TABLE IF NOT EXISTS sales (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         date TEXT,
         sales_rep TEXT,
@@ -125,180 +456,1422 @@ def init_db():
         order_no TEXT,
         last_follow_up_date TEXT, 
         next_follow_up_date TEXT   
-    )''')
-    conn.commit()
-    conn.close()
-
-# 核心修改：确保 get_data 返回时，如果需要，列名已经是中文
-def get_data(rename_cols=False):
-    conn = sqlite3.connect(DB_FILE)
-    df = pd.read_sql_query("SELECT * FROM sales", conn)
-    conn.close()
-    
-    # 只有在明确要求时才进行列名转换
-    if rename_cols:
-        df.rename(columns=CRM_COL_MAP, inplace=True)
-    
+    );''',
+    # v2: 热点查询索引 (查重、单条读取、超期扫描、个人待办提醒)
+    '''CREATE INDEX IF NOT EXISTS idx_sales_customer_name ON sales(customer_name);
+    CREATE INDEX IF NOT EXISTS idx_sales_phone ON sales(phone);
+    CREATE INDEX IF NOT EXISTS idx_sales_rep_next_fup ON sales(sales_rep, next_follow_up_date);
+    CREATE INDEX IF NOT EXISTS idx_sales_status ON sales(status);
+    CREATE INDEX IF NOT EXISTS idx_sales_next_fup ON sales(next_follow_up_date);
+    CREATE INDEX IF NOT EXISTS idx_sales_last_fup ON sales(last_follow_up_date);
+    ANALYZE sales;''',
+    # v3: 变更追踪 —— 每次插入/修改分配递增的 row_version，删除写入墓碑表，供增量同步使用
+    '''CREATE TABLE IF NOT EXISTS sales_change_seq (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        seq INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS sales_tombstones (
+        id INTEGER PRIMARY KEY,
+        row_version INTEGER NOT NULL
+    );
+    ALTER TABLE sales ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE sales ADD COLUMN updated_at TEXT;
+    UPDATE sales SET row_version = id, updated_at = datetime('now', 'localtime');
+    INSERT OR IGNORE INTO sales_change_seq (id, seq) SELECT 1, COALESCE(MAX(id), 0) FROM sales;
+    CREATE INDEX IF NOT EXISTS idx_sales_row_version ON sales(row_version);
+    CREATE INDEX IF NOT EXISTS idx_sales_tombstones_version ON sales_tombstones(row_version);
+    CREATE TRIGGER IF NOT EXISTS trg_sales_version_insert AFTER INSERT ON sales
+    BEGIN
+        UPDATE sales_change_seq SET seq = seq + 1 WHERE id = 1;
+        UPDATE sales SET row_version = (SELECT seq FROM sales_change_seq WHERE id = 1),
+                         updated_at = datetime('now', 'localtime')
+        WHERE id = NEW.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_sales_version_update AFTER UPDATE ON sales
+    WHEN NEW.row_version = OLD.row_version
+    BEGIN
+        UPDATE sales_change_seq SET seq = seq + 1 WHERE id = 1;
+        UPDATE sales SET row_version = (SELECT seq FROM sales_change_seq WHERE id = 1),
+                         updated_at = datetime('now', 'localtime')
+        WHERE id = NEW.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_sales_version_delete AFTER DELETE ON sales
+    BEGIN
+        UPDATE sales_change_seq SET seq = seq + 1 WHERE id = 1;
+        INSERT OR REPLACE INTO sales_tombstones (id, row_version)
+        VALUES (OLD.id, (SELECT seq FROM sales_change_seq WHERE id = 1));
+    END;''',
+    # v4: 跟进记录独立成只追加的 follow_ups 表
+    _migrate_follow_up_history,
+    # v5: 月度汇总表及其维护触发器 (并按现有数据初始化)
+    SALES_ROLLUP_SQL,
+    # v6: 客户搜索全文索引
+    SALES_FTS_SQL,
+    # v7: 客户列表按录入月份筛选/排序的索引
+    '''CREATE INDEX IF NOT EXISTS idx_sales_date ON sales(date);
+    CREATE INDEX IF NOT EXISTS idx_sales_rep_date ON sales(sales_rep, date);
+    ANALYZE sales;''',
+    # v8: 后台任务表 (导出、维护等耗时操作)
+    '''CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        params TEXT NOT NULL DEFAULT '{}',
+        owner TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        created_at TEXT NOT NULL,
+        started_at TEXT,
+        finished_at TEXT,
+        expires_at TEXT,
+        result_path TEXT,
+        result_rows INTEGER,
+        message TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs(owner, id);
+    CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, expires_at);''',
+    # v9: 客户名/电话规范化键及索引，用于查重
+    _migrate_customer_keys,
+    # v10: 管理员维护操作审计表 (每次操作一条记录)
+    '''CREATE TABLE IF NOT EXISTS maintenance_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        fix TEXT NOT NULL,
+        operator TEXT NOT NULL,
+        performed_at TEXT NOT NULL,
+        predicate TEXT,
+        affected_ids TEXT NOT NULL DEFAULT '[]',
+        rows INTEGER NOT NULL DEFAULT 0
+    );''',
+    # v11: 总金额/毛利/含运费总额改为生成列
+    _migrate_derived_amounts,
+    # v12: 推广归因按 店铺+来源 查找月度汇总行的索引
+    '''CREATE INDEX IF NOT EXISTS idx_sales_rollup_shop_source ON sales_monthly_rollup(shop_name, source, month);
+    ANALYZE sales_monthly_rollup;''',
+    # v13: 移除 v3 的变更追踪 (增量同步的整表缓存已删除，不再有读取方)；row_version/updated_at 列保留，不再维护
+    '''DROP TRIGGER IF EXISTS trg_sales_version_insert;
+    DROP TRIGGER IF EXISTS trg_sales_version_update;
+    DROP TRIGGER IF EXISTS trg_sales_version_delete;
+    DROP INDEX IF EXISTS idx_sales_row_version;
+    DROP TABLE IF EXISTS sales_tombstones;
+    DROP TABLE IF EXISTS sales_change_seq;''',
+    # v14: 搜索索引内容补尾部空格并建词表，1~2 个字符的搜索 (含跟进内容) 也走索引
+    SEARCH_FTS_PADDED_SQL,
+]
+
+PROMO_DB_MIGRATIONS = [
+    # v1: 推广数据表
+    '''CREATE TABLE IF NOT EXISTS promotions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        month TEXT,
+        shop TEXT,
+        promo_type TEXT,
+        total_spend REAL,
+        trans_spend REAL,
+        net_gmv REAL,
+        net_roi REAL,
+        cpa_net REAL,
+        inquiry_count INTEGER,
+        inquiry_spend REAL,
+        cpl REAL,
+        note TEXT
+    );''',
+    # v2: 按月份/店铺查询的索引
+    '''CREATE INDEX IF NOT EXISTS idx_promotions_month_shop ON promotions(month, shop);''',
+    # v3: 看板按 月份/店铺/推广类型 分组，(month, shop, promo_type) 覆盖原 (month, shop) 索引
+    '''CREATE INDEX IF NOT EXISTS idx_promotions_month_shop_type ON promotions(month, shop, promo_type);
+    CREATE INDEX IF NOT EXISTS idx_promotions_shop ON promotions(shop);
+    DROP INDEX IF EXISTS idx_promotions_month_shop;
+    ANALYZE promotions;''',
+]
+
+def _execute_script(conn, script):
+    # 在当前事务内逐条执行 (conn.executescript 会先隐式 COMMIT，无法保证迁移原子性)
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ''
+    if statement.strip():
+        conn.execute(statement)
+
+def run_migrations(db_file, migrations):
+    # 逐个版本执行，每个版本一个事务；BEGIN IMMEDIATE 后重新读取版本号，防止多个进程重复迁移
+    with db_conn(db_file) as conn:
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(migrations):
+                conn.rollback()
+                return version
+            step = migrations[version]
+            if callable(step):
+                step(conn)
+            else:
+                _execute_script(conn, step)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+
+# --- 数据版本号与进程级缓存 ---
+# 每张业务表一个版本号：写入提交后 +1，缓存以版本号为键，版本不变即直接复用
+class DataVersions:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+
+    def get(self, name):
+        with self._lock:
+            return self._versions.get(name, 0)
+
+    def bump(self, name):
+        with self._lock:
+            self._versions[name] = self._versions.get(name, 0) + 1
+            return self._versions[name]
+
+@st.cache_resource
+def get_data_versions():
+    return DataVersions()
+
+def data_version(name):
+    return get_data_versions().get(name)
+
+# --- 列投影与类型化读取 ---
+# 查重用的规范化键：写入时由 Python 计算，不在页面和导出中展示
+SALES_KEY_COLS = ['name_norm', 'phone_norm']
+# sales 表的业务列 (跟进历史已独立成 follow_ups 表)
+SALES_COLUMNS = [col for col in CRM_COL_MAP if col != 'follow_up_history']
+PROMO_COLUMNS = list(PROMO_COL_MAP)
+
+# 读取时一次性完成类型转换，页面不再需要 pd.to_numeric / pd.to_datetime
+SALES_DTYPES = {col: 'float64' for col in ('unit_price', 'area', 'construction_fee', 'material_fee', 'shipping_fee', *SALES_DERIVED_COLS)}
+SALES_DATE_COLS = ['date', 'last_follow_up_date', 'next_follow_up_date']
+# 取值来自固定下拉选项的列读成分类 (整数编码)；类别 = 选项 + 结果中出现的其他值，对接人 (中文名) 的类别直接取自结果
+SALES_CATEGORIES = {
+    'sales_rep': [], 'source': SOURCE_OPTIONS, 'shop_name': SHOP_OPTIONS, 'site_type': SITE_OPTIONS,
+    'status': STATUS_OPTIONS, 'is_construction': CONSTRUCTION_OPTIONS, 'purchase_intent': INTENT_OPTIONS,
+}
+PROMO_DTYPES = {col: 'float64' for col in ('total_spend', 'trans_spend', 'net_gmv', 'net_roi', 'cpa_net', 'inquiry_spend', 'cpl')}
+PROMO_DTYPES['inquiry_count'] = 'int64'
+
+def read_sql_typed(conn, table, columns, dtypes=None, date_cols=(), where='', params=(), categories=None):
+    # 只 SELECT 需要的列；数值列按 dtypes 读取并以 0 填充空值，日期列解析为 datetime64 (非法值为 NaT)，categories 中的列转为分类
+    # 金额列保持 float64：按元累计的合计金额超出 float32 的有效位数
+    dtypes = {col: dtype for col, dtype in (dtypes or {}).items() if col in columns}
+    df = pd.read_sql_query(
+        f"SELECT {', '.join(columns)} FROM {table} {where}", conn, params=params,
+        dtype={col: 'float64' for col in dtypes} or None,
+        parse_dates={col: {'errors': 'coerce'} for col in date_cols if col in columns} or None)
+    if dtypes:
+        df[list(dtypes)] = df[list(dtypes)].fillna(0)
+        df = df.astype({col: dtype for col, dtype in dtypes.items() if dtype != 'float64'})
+    # 按结果列名判断：列表达式 (如 "... AS sales_rep") 也能匹配
+    for col, options in (categories or {}).items():
+        if col in df:
+            extra = sorted(set(df[col].dropna().unique()) - set(options))
+            df[col] = pd.Categorical(df[col], categories=[*options, *extra])
     return df
 
-def add_data(data):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''INSERT INTO sales (
-        date, sales_rep, customer_name, phone, source, shop_name, unit_price, area, 
-        site_type, status, is_construction, construction_fee, material_fee, shipping_fee,
-        purchase_intent, total_amount, follow_up_history, sample_no, order_no,
-        last_follow_up_date, next_follow_up_date 
-    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', data)
-    conn.commit()
-    conn.close()
+def frame_memory_report(df):
+    # 每列的类型与内存占用 (字节)，并对比分类列按普通字符串存储时的占用
+    plain = df.astype({col: df[col].cat.categories.dtype for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)})
+    return pd.DataFrame({
+        'dtype': df.dtypes.astype(str),
+        'bytes': df.memory_usage(deep=True, index=False),
+        'plain_bytes': plain.memory_usage(deep=True, index=False),
+    }).rename_axis('column').reset_index()
+
+def _check_columns(columns, allowed):
+    unknown = [col for col in columns if col not in allowed]
+    if unknown:
+        raise ValueError(f"未知列: {', '.join(unknown)}")
+    return list(columns)
+
+def notify_sales_changed():
+    # 写入提交后调用：推进版本号，按版本缓存的读取随之失效
+    get_data_versions().bump('sales')
+
+# --- 数据库函数 (用户管理) ---
+def init_user_db():
+    run_migrations(USER_DB_FILE, USER_DB_MIGRATIONS)
+    with db_conn(USER_DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute("SELECT COUNT(*) FROM users")
+        if c.fetchone()[0] == 0:
+            for username, data in INITIAL_USERS.items():
+                c.execute("INSERT INTO users VALUES (?, ?, ?, ?)", 
+                          (username, data['password'], data['role'], data['display_name']))
+
+class UserDirectory:
+    # 进程内用户目录 (username -> 角色/中文名，不含密码)；新增用户后按 'users' 数据版本重新加载
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.users = {}
+        self.display_names = {}
+        self.display_names_json = '{}'
+
+    def get(self):
+        version = data_version('users')
+        with self.lock:
+            if self.version != version:
+                with db_conn(USER_DB_FILE) as conn:
+                    rows = conn.execute("SELECT username, role, display_name FROM users ORDER BY rowid").fetchall()
+                self.users = {username: {'role': role, 'display_name': display_name} for username, role, display_name in rows}
+                self.display_names = {username: info['display_name'] for username, info in self.users.items()}
+                self.display_names_json = json.dumps(self.display_names, ensure_ascii=False)
+                self.version = version
+            return self
+
+@st.cache_resource
+def get_user_directory():
+    return UserDirectory()
+
+def notify_users_changed():
+    get_data_versions().bump('users')
+
+def get_all_users():
+    users = get_user_directory().get().users
+    return pd.DataFrame([{'username': username, **info} for username, info in users.items()],
+                        columns=['username', 'role', 'display_name'])
+
+def get_user_info(username):
+    # 登录校验需要密码，直接查库
+    with db_conn(USER_DB_FILE) as conn:
+        result = conn.execute("SELECT password, role, display_name FROM users WHERE username=?", (username,)).fetchone()
+    if result:
+        return {'password': result[0], 'role': result[1], 'display_name': result[2]}
+    return None
+
+def add_new_user(username, password, role, display_name):
+    try:
+        with db_conn(USER_DB_FILE) as conn:
+            conn.execute("INSERT INTO users VALUES (?, ?, ?, ?)", (username, password, role, display_name))
+    except sqlite3.IntegrityError:
+        return False
+    notify_users_changed()
+    return True
+
+def get_user_map():
+    # username -> 中文名；返回缓存中的字典，调用方不要修改
+    return get_user_directory().get().display_names
+
+# 对接人中文名在读取时由 SQL 关联，不在页面上逐行映射：用户目录作为一个 JSON 参数传入，用户不存在时保留 username
+REP_NAME_SQL = "COALESCE(reps.rep_name, {rep_col})"
+
+def rep_name_join(rep_col='sales.sales_rep'):
+    # 返回 (JOIN 子句, 参数)；选择列用 REP_NAME_SQL.format(rep_col=...)
+    return (f"LEFT JOIN (SELECT key AS rep_username, value AS rep_name FROM json_each(?)) reps ON reps.rep_username = {rep_col}",
+            (get_user_directory().get().display_names_json,))
+
+def rep_name_columns(columns, rep_col='sales.sales_rep'):
+    # 列投影中的 sales_rep 换成中文名 (列名不变)
+    return [f"{REP_NAME_SQL.format(rep_col=rep_col)} AS sales_rep" if col == 'sales_rep' else col for col in columns]
+
+# --- 数据库函数 (CRM 客户数据) ---
+def init_db():
+    run_migrations(DB_FILE, SALES_DB_MIGRATIONS)
+
+def _insert_follow_up(conn, record_id, text, author, next_date=None, status=None, intent=None):
+    conn.execute(
+        "INSERT INTO follow_ups (record_id, timestamp, author, text, next_date, status, intent) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (record_id, datetime.datetime.now().strftime('%Y-%m-%d %H:%M'), author, text, next_date, status, intent))
+
+# data 不含跟进历史和派生金额 (由数据库计算)；首次沟通记录作为第一条跟进写入 follow_ups
+def add_data(data, first_log, author):
+    with db_conn(DB_FILE) as conn:
+        c = conn.execute('''INSERT INTO sales (
+            date, sales_rep, customer_name, phone, source, shop_name, unit_price, area,
+            site_type, status, is_construction, construction_fee, material_fee, shipping_fee,
+            purchase_intent, sample_no, order_no,
+            last_follow_up_date, next_follow_up_date, name_norm, phone_norm
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            (*data, normalize_name(data[2]), normalize_phone(data[3])))
+        _insert_follow_up(conn, c.lastrowid, first_log, author, next_date=data[18], status=data[9], intent=data[14])
+    notify_sales_changed()
 
 def get_single_record(record_id):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT * FROM sales WHERE id=?", (record_id,))
-    columns = [desc[0] for desc in c.description]
-    record = c.fetchone()
-    conn.close()
+    with db_conn(DB_FILE) as conn:
+        c = conn.execute("SELECT * FROM sales WHERE id=?", (record_id,))
+        columns = [desc[0] for desc in c.description]
+        record = c.fetchone()
     if record:
         return dict(zip(columns, record))
     return None
 
+def get_follow_ups(record_id):
+    # 按需加载单个客户的跟进记录，只在页面展示该客户时调用
+    with db_conn(DB_FILE) as conn:
+        return pd.read_sql_query(
+            "SELECT timestamp, author, text, next_date, status, intent FROM follow_ups WHERE record_id=? ORDER BY id",
+            conn, params=(int(record_id),))
+
+def get_follow_up_history_text(record_ids, conn=None):
+    # 导出用：指定客户的跟进记录按旧格式拼成一段文本，返回 {record_id: text}；可传入已有连接以共用读事务
+    sql = """
+        SELECT record_id, group_concat(line, char(10)) FROM (
+            SELECT record_id, '[' || TRIM(COALESCE(timestamp, '') || ' ' || COALESCE(author, '')) || ']: ' || COALESCE(text, '') AS line
+            FROM follow_ups WHERE record_id IN (SELECT value FROM json_each(?)) ORDER BY record_id, id
+        ) GROUP BY record_id
+    """
+    params = (json.dumps([int(i) for i in record_ids]),)
+    if conn is not None:
+        return dict(conn.execute(sql, params).fetchall())
+    with db_conn(DB_FILE) as own_conn:
+        return dict(own_conn.execute(sql, params).fetchall())
+
+def _fts_match_expr(conn, vocab, term):
+    # 返回 (FTS 查询表达式, 是否可按相关度排序)；没有任何词元能匹配时表达式为 None
+    if len(term) >= 3:
+        # 整体作为短语匹配，避免用户输入被解析成 FTS 语法
+        return '"' + term.replace('"', '""') + '"', True
+    # 1~2 个字符 (如两字姓名)：从词表按前缀取出以它开头的三字词元，OR 起来查询 (trigram 词元不区分大小写)
+    prefix = term.lower()
+    grams = [row[0] for row in conn.execute(f"SELECT term FROM {vocab} WHERE term >= ? AND term < ?", (prefix, prefix + '\U0010ffff'))]
+    if not grams:
+        return None, False
+    return ' OR '.join('"' + gram.replace('"', '""') + '"' for gram in grams), False
+
+def _search_customer_ids(conn, term, limit):
+    # 相关度只对三字以上的短语有意义；短词按最新录入 / 最新跟进排序，命中很多时取够 limit 个即停
+    ids = []
+    expr, ranked = _fts_match_expr(conn, 'sales_fts_vocab', term)
+    if expr:
+        ids += [row[0] for row in conn.execute(
+            f"SELECT rowid FROM sales_fts WHERE sales_fts MATCH ? ORDER BY {'rank' if ranked else 'rowid DESC'} LIMIT ?", (expr, limit))]
+    expr, ranked = _fts_match_expr(conn, 'follow_ups_fts_vocab', term)
+    if expr and ranked:
+        ids += [row[0] for row in conn.execute("""
+            SELECT f.record_id FROM follow_ups_fts JOIN follow_ups f ON f.id = follow_ups_fts.rowid
+            WHERE follow_ups_fts MATCH ? GROUP BY f.record_id ORDER BY MIN(follow_ups_fts.rank) LIMIT ?""", (expr, limit))]
+    elif expr:
+        ids += [row[0] for row in conn.execute("""
+            SELECT f.record_id FROM follow_ups_fts JOIN follow_ups f ON f.id = follow_ups_fts.rowid
+            WHERE follow_ups_fts MATCH ? ORDER BY follow_ups_fts.rowid DESC LIMIT ?""", (expr, limit))]
+    return ids
+
+# 列表页搜索最多取客户字段、跟进内容各自最新的这么多条命中 (只对这些计算相关度)，耗时不随表的大小增长
+SEARCH_MATCH_LIMIT = 2000
+
+def _search_match_sql(conn, term):
+    # 列表页的搜索命中作为子查询在 SQL 内关联，不把命中 ID 取回 Python；没有可匹配的词元时返回 None
+    # 返回 (子查询, 参数)：每个客户一行 (match_id, match_tier, match_rank)，客户字段命中 match_tier = 0，
+    # 仅跟进内容命中为 1；match_rank 越小越相关 (短词没有相关度，为 0)
+    sales_expr, sales_ranked = _fts_match_expr(conn, 'sales_fts_vocab', term)
+    fu_expr, fu_ranked = _fts_match_expr(conn, 'follow_ups_fts_vocab', term)
+    sales_hits = "SELECT rowid AS match_id, {rank} AS match_rank FROM sales_fts WHERE sales_fts MATCH ? ORDER BY rowid DESC LIMIT ?"
+    parts, params = [], []
+    if sales_expr:
+        parts.append(f"SELECT match_id, 0 AS match_tier, match_rank FROM ({sales_hits.format(rank='rank' if sales_ranked else '0')})")
+        params += [sales_expr, SEARCH_MATCH_LIMIT]
+    if fu_expr:
+        exclude = f"WHERE record_id NOT IN (SELECT match_id FROM ({sales_hits.format(rank='0')}))" if sales_expr else ''
+        parts.append(f"""SELECT record_id AS match_id, 1 AS match_tier, MIN(fu_rank) AS match_rank FROM (
+            SELECT f.record_id, {'follow_ups_fts.rank' if fu_ranked else '0'} AS fu_rank
+            FROM follow_ups_fts JOIN follow_ups f ON f.id = follow_ups_fts.rowid
+            WHERE follow_ups_fts MATCH ? ORDER BY follow_ups_fts.rowid DESC LIMIT ?
+        ) {exclude} GROUP BY record_id""")
+        params += [fu_expr, SEARCH_MATCH_LIMIT] + ([sales_expr, SEARCH_MATCH_LIMIT] if sales_expr else [])
+    if not parts:
+        return None
+    return " UNION ALL ".join(parts), params
+
+def search_customers(term, limit=None, conn=None):
+    # 返回匹配的客户 ID 列表 (按相关度排序)：客户名/电话/店铺/订单号/寄样单号命中在前，跟进内容命中在后
+    # 调用方已持有连接时传入 conn，避免同时占用连接池中的两个连接
+    term = (term or '').strip()
+    if not term:
+        return []
+    limit = -1 if limit is None else int(limit)
+    if conn is not None:
+        ids = _search_customer_ids(conn, term, limit)
+    else:
+        with db_conn(DB_FILE) as own_conn:
+            ids = _search_customer_ids(own_conn, term, limit)
+    # 去重并保持排序
+    ids = list(dict.fromkeys(ids))
+    return ids if limit < 0 else ids[:limit]
+
+# 客户列表排序选项：显示名 -> (列, 是否倒序)
+SALES_SORT_OPTIONS = {
+    '最新录入': ('id', True),
+    '录入日期 (新→旧)': ('date', True),
+    '计划下次跟进 (近→远)': ('next_follow_up_date', False),
+    '上次跟进 (久→近)': ('last_follow_up_date', False),
+    '预估总金额 (高→低)': ('total_amount', True),
+}
+
+def query_sales_page(month=None, sales_rep=None, search_term=None, sort_key='最新录入', page=1, page_size=50):
+    # 筛选、排序、分页全部在 SQL 中完成，只读取当前页的行；返回 (当前页 DataFrame, 符合条件的总行数)
+    # month 为 'YYYY-MM'；有搜索词时默认按相关度排序
+    where, params = [], []
+    if month:
+        start = f"{month}-01"
+        year, mon = int(month[:4]), int(month[5:7])
+        end = f"{year + mon // 12:04d}-{mon % 12 + 1:02d}-01"
+        where.append("date >= ? AND date < ?")
+        params += [start, end]
+    if sales_rep:
+        where.append("sales.sales_rep = ?")
+        params.append(sales_rep)
+
+    order_col, descending = SALES_SORT_OPTIONS.get(sort_key, SALES_SORT_OPTIONS['最新录入'])
+    order_sql = f"{order_col} {'DESC' if descending else 'ASC'}, id DESC"
+    page_size = max(int(page_size), 1)
+    offset = (max(int(page), 1) - 1) * page_size
+    with db_conn(DB_FILE) as conn:
+        source, join_params = 'sales', []
+        if search_term and search_term.strip():
+            match = _search_match_sql(conn, search_term.strip())
+            if match is None:
+                return pd.DataFrame(columns=SALES_COLUMNS), 0
+            source, join_params = f"sales JOIN ({match[0]}) m ON m.match_id = sales.id", match[1]
+            if sort_key == '最新录入':
+                order_sql = "m.match_tier, m.match_rank, id DESC"
+
+        where_sql = f"WHERE {' AND '.join(where)}" if where else ''
+        total = conn.execute(f"SELECT COUNT(*) FROM {source} {where_sql}", (*join_params, *params)).fetchone()[0]
+        # 返回的 sales_rep 已是对接人中文名 (用于展示)；计数不需要关联用户目录
+        reps_sql, reps_params = rep_name_join()
+        df = read_sql_typed(conn, f"{source} {reps_sql}", rep_name_columns(SALES_COLUMNS), SALES_DTYPES, SALES_DATE_COLS,
+                            where=f"{where_sql} ORDER BY {order_sql} LIMIT ? OFFSET ?",
+                            params=(*join_params, *reps_params, *params, page_size, offset), categories=SALES_CATEGORIES)
+    return df, total
+
+def sales_memory_report():
+    # 按列表页的类型化方式读取整表一次 (不缓存)，返回 (行数, 各列内存占用)
+    reps_sql, reps_params = rep_name_join()
+    with db_conn(DB_FILE) as conn:
+        df = read_sql_typed(conn, f"sales {reps_sql}", rep_name_columns(SALES_COLUMNS), SALES_DTYPES, SALES_DATE_COLS,
+                            params=reps_params, categories=SALES_CATEGORIES)
+    return len(df), frame_memory_report(df)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _sales_months(version):
+    with db_conn(DB_FILE) as conn:
+        return [row[0] for row in conn.execute(
+            "SELECT DISTINCT month FROM sales_monthly_rollup WHERE month != '' ORDER BY month DESC")]
+
+def get_sales_months():
+    # 录入月份下拉选项 ('YYYY-MM')，直接取自月度汇总表
+    return _sales_months(data_version('sales'))
+
+CUSTOMER_PICKER_LIMIT = 20
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _customer_choices(version, users_version, term, limit):
+    # 客户选择器候选：不输入时列出最新录入的客户，输入时取搜索结果的前 limit 个；纯数字额外按 ID 精确匹配
+    # sales_rep 保留 username (用于权限判断)，rep_name 为中文名
+    term = (term or '').strip()
+    reps_sql, reps_params = rep_name_join()
+    columns = ['id', 'customer_name', 'sales_rep', f"{REP_NAME_SQL.format(rep_col='sales.sales_rep')} AS rep_name"]
+    with db_conn(DB_FILE) as conn:
+        if not term:
+            df = read_sql_typed(conn, f"sales {reps_sql}", columns,
+                                where="ORDER BY id DESC LIMIT ?", params=(*reps_params, limit), categories=SALES_CATEGORIES)
+        else:
+            ids = search_customers(term, limit, conn=conn)
+            if term.isdigit():
+                ids = list(dict.fromkeys([int(term), *ids]))[:limit]
+            df = read_sql_typed(conn, f"sales JOIN (SELECT value AS match_id, key AS match_rank FROM json_each(?)) m ON m.match_id = sales.id {reps_sql}",
+                                columns, where="ORDER BY m.match_rank", params=(json.dumps(ids), *reps_params), categories=SALES_CATEGORIES)
+    # 标签整列拼接，不逐行循环
+    df['label'] = df['id'].astype(str) + " - " + df['customer_name'].fillna('') + " (" + df['rep_name'].fillna('') + ")"
+    return df.set_index('id', drop=False)
+
+def find_customers(term='', limit=CUSTOMER_PICKER_LIMIT):
+    # 返回以 ID 为索引的候选 DataFrame (含 label 列)；按 sales / 用户目录版本缓存，同一关键词重复渲染不再查库
+    return _customer_choices(data_version('sales'), data_version('users'), term, int(limit))
+
 def admin_update_data(record_id, data):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    # 🚨 更改逻辑：总金额不再包含运费
-    total_amount = (data['unit_price'] * data['area']) + data['construction_fee'] + data['material_fee'] 
-    
-    c.execute('''UPDATE sales SET
-        customer_name=?, phone=?, source=?, shop_name=?, unit_price=?, area=?, 
-        site_type=?, is_construction=?, construction_fee=?, material_fee=?, shipping_fee=?,
-        total_amount=?
-        WHERE id=?''', (
-        data['customer_name'], data['phone'], data['source'], data['shop_name'], data['unit_price'], data['area'], 
-        data['site_type'], data['is_construction'], data['construction_fee'], data['material_fee'], data['shipping_fee'],
-        total_amount, record_id
-    ))
-    conn.commit()
-    conn.close()
-    update_follow_up(record_id, "[管理员修改]: 基本信息(不含运费)已更新，金额已重算。", 
-                     datetime.date.today().isoformat(), data['status'], data['purchase_intent'])
+    # 总金额 (不含运费) 由数据库生成列计算
+    with db_conn(DB_FILE) as conn:
+        conn.execute('''UPDATE sales SET
+            customer_name=?, phone=?, source=?, shop_name=?, unit_price=?, area=?,
+            site_type=?, is_construction=?, construction_fee=?, material_fee=?, shipping_fee=?,
+            name_norm=?, phone_norm=?
+            WHERE id=?''', (
+            data['customer_name'], data['phone'], data['source'], data['shop_name'], data['unit_price'], data['area'],
+            data['site_type'], data['is_construction'], data['construction_fee'], data['material_fee'], data['shipping_fee'],
+            normalize_name(data['customer_name']), normalize_phone(data['phone']), record_id
+        ))
+    notify_sales_changed()
+    update_follow_up(record_id, "基本信息(不含运费)已更新，金额已重算。",
+                     datetime.date.today().isoformat(), data['status'], data['purchase_intent'], author='管理员修改')
 
 def delete_data(record_id):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("DELETE FROM sales WHERE id=?", (record_id,))
-    conn.commit()
-    conn.close()
-
-def transfer_sales_rep(record_id, new_rep_username):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    user_info = get_user_info(new_rep_username)
-    display_name = user_info['display_name'] if user_info else new_rep_username
-    log = f"\n[{datetime.date.today()}] 系统转交：已转交给 {display_name}"
-    c.execute("UPDATE sales SET sales_rep=?, status='转交管理', last_follow_up_date=?, follow_up_history=follow_up_history || ? WHERE id=?", 
-              (new_rep_username, datetime.date.today().isoformat(), log, record_id))
-    conn.commit()
-    conn.close()
-
-def update_follow_up(record_id, new_log, next_date, new_status, new_intent):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("""
-        UPDATE sales 
-        SET follow_up_history = follow_up_history || ?, 
-            last_follow_up_date = ?, 
-            next_follow_up_date = ?,
-            status = ?,
-            purchase_intent = ?
-        WHERE id = ?
-    """, (f"\n{new_log}", datetime.date.today().isoformat(), next_date, new_status, new_intent, record_id))
-    conn.commit()
-    conn.close()
+    with db_conn(DB_FILE) as conn:
+        conn.execute("DELETE FROM sales WHERE id=?", (record_id,))
+        conn.execute("DELETE FROM follow_ups WHERE record_id=?", (record_id,))
+    notify_sales_changed()
+
+def transfer_sales_reps(record_ids, new_rep_username):
+    # 批量转交：一次事务内完成，转交人中文名只查一次；返回 (实际转交行数, 耗时毫秒)
+    start = time.perf_counter()
+    ids = json.dumps([int(i) for i in record_ids])
+    if ids == '[]':
+        return 0, 0.0
+    display_name = get_user_map().get(new_rep_username, new_rep_username)
+    now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M')
+    with db_conn(DB_FILE) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute("""
+            UPDATE sales SET sales_rep = ?, status = '转交管理', last_follow_up_date = ?
+            WHERE id IN (SELECT value FROM json_each(?))""",
+            (new_rep_username, datetime.date.today().isoformat(), ids)).rowcount
+        # 只为存在的记录写转交日志
+        conn.execute("""
+            INSERT INTO follow_ups (record_id, timestamp, author, text, status)
+            SELECT id, ?, '系统', ?, '转交管理' FROM sales WHERE id IN (SELECT value FROM json_each(?))""",
+            (now, f"系统转交：已转交给 {display_name}", ids))
+    notify_sales_changed()
+    return rows, (time.perf_counter() - start) * 1000
+
+def update_follow_up(record_id, new_log, next_date, new_status, new_intent, author='系统'):
+    with db_conn(DB_FILE) as conn:
+        conn.execute("""
+            UPDATE sales
+            SET last_follow_up_date = ?,
+                next_follow_up_date = ?,
+                status = ?,
+                purchase_intent = ?
+            WHERE id = ?
+        """, (datetime.date.today().isoformat(), next_date, new_status, new_intent, record_id))
+        _insert_follow_up(conn, record_id, new_log, author, next_date=next_date, status=new_status, intent=new_intent)
+    notify_sales_changed()
+
+def find_duplicate_customers(names, phones, conn=None):
+    # 批量查重：按规范化的客户名或 (非空) 电话匹配已有客户，一次查询，每个候选走索引查找
+    # 返回与输入等长、索引对齐的 DataFrame (match_id, match_rep)，未匹配为 NaN；客户名匹配优先
+    # 调用方在写事务内查重时传入 conn，查重结果与随后的插入来自同一个快照
+    name_keys, phone_keys = normalize_names(names), normalize_phones(phones)
+    sql = """
+        SELECT name_norm, phone_norm, id, sales_rep FROM sales
+        WHERE name_norm IN (SELECT value FROM json_each(?)) OR phone_norm IN (SELECT value FROM json_each(?))
+        ORDER BY id"""
+    params = (json.dumps(name_keys[name_keys != ''].unique().tolist()), json.dumps(phone_keys[phone_keys != ''].unique().tolist()))
+    if conn is not None:
+        existing = conn.execute(sql, params).fetchall()
+    else:
+        with db_conn(DB_FILE) as own_conn:
+            existing = own_conn.execute(sql, params).fetchall()
+    # 同一个键有多条已有记录时取最早录入的一条
+    by_name, by_phone, reps = {}, {}, {}
+    for name_key, phone_key, record_id, rep in existing:
+        by_name.setdefault(name_key, record_id)
+        if phone_key:
+            by_phone.setdefault(phone_key, record_id)
+        reps[record_id] = rep
+    match_ids = name_keys.map(by_name).fillna(phone_keys.where(phone_keys != '').map(by_phone))
+    return pd.DataFrame({'match_id': match_ids, 'match_rep': match_ids.map(reps)}, index=name_keys.index)
 
 def check_customer_exist(name, phone):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    # 增加对 phone 字段非空判断，避免空电话号码导致误判
-    # 修复了在 8c9a0402d646a00b1b7df684f50c0e75.png 中出现的 SQLite operational error
-    c.execute("SELECT sales_rep FROM sales WHERE customer_name=? OR (phone IS NOT NULL AND phone != '' AND phone=?)", (name, phone))
-    result = c.fetchone()
-    conn.close()
-    return result[0] if result else None
-
-# --- 管理员功能：批量修复单价/面积互换 ---
-def admin_fix_area_price_swap():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    # 1. 临时交换 unit_price 和 area
-    c.execute("UPDATE sales SET unit_price = area, area = unit_price")
-    
-    # 2. 重新计算 total_amount (🚨 更改逻辑：不包含运费)
-    c.execute("""
-        UPDATE sales 
-        SET total_amount = (unit_price * area) + construction_fee + material_fee
-    """)
-    
-    # 3. 记录操作
-    log_message = f"\n[{datetime.date.today()}] [系统管理员操作]: 批量修复单价和面积数据互换，并重新计算了**不含运费**的总金额。"
-    c.execute("UPDATE sales SET follow_up_history = follow_up_history || ?", (log_message,))
-    
-    conn.commit()
-    rows_affected = c.rowcount
-    conn.close()
-    return rows_affected
+    # 返回已有客户的对接人，不存在返回 None
+    match = find_duplicate_customers([name], [phone]).iloc[0]
+    return None if pd.isna(match['match_rep']) else match['match_rep']
+
+def find_duplicate_clusters():
+    # 管理员报告：规范化客户名或电话相同的记录连成一簇 (A 与 B 同名、B 与 C 同电话 → A/B/C 一簇)
+    # 分组走规范化键索引，只有出现重复的记录才进入 Python 做并查集
+    with db_conn(DB_FILE) as conn:
+        links = conn.execute("""
+            SELECT group_concat(id) FROM sales WHERE name_norm != '' GROUP BY name_norm HAVING COUNT(*) > 1
+            UNION ALL
+            SELECT group_concat(id) FROM sales WHERE phone_norm != '' GROUP BY phone_norm HAVING COUNT(*) > 1
+        """).fetchall()
+        parent = {}
+
+        def find(i):
+            while parent.setdefault(i, i) != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for (ids,) in links:
+            ids = [int(i) for i in ids.split(',')]
+            root = find(ids[0])
+            for i in ids[1:]:
+                parent[find(i)] = root
+        if not parent:
+            return pd.DataFrame(columns=['cluster', 'id', 'customer_name', 'phone', 'sales_rep', 'date'])
+        # sales_rep 为对接人中文名 (报告只用于展示)
+        reps_sql, reps_params = rep_name_join()
+        df = read_sql_typed(conn, f"sales {reps_sql}", rep_name_columns(['id', 'customer_name', 'phone', 'sales_rep', 'date']), date_cols=['date'],
+                            where="WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id", params=(*reps_params, json.dumps(list(parent))),
+                            categories=SALES_CATEGORIES)
+    # 簇编号按簇内最小 ID 排序，从 1 开始
+    first_ids = df.groupby(df['id'].map(find))['id'].transform('min')
+    df.insert(0, 'cluster', first_ids.rank(method='dense').astype('int64'))
+    return df.sort_values(['cluster', 'id'], ignore_index=True)
+
+# --- 管理员维护操作 (按条件圈定记录，先预览再执行，一次事务 + 一条审计记录) ---
+# 修复项：where 圈定疑似问题记录；set 为 列 -> 新值表达式 (表达式中的列取更新前的值)；show 为预览时展示的列
+MAINTENANCE_FIXES = {
+    'swap_area_price': {
+        'label': '修复单价/面积数据互换',
+        'hint': '单价大于平方数的记录 (正常情况下单价远小于面积)',
+        'where': "unit_price > area AND area > 0",
+        # 总金额由生成列自动重算
+        'set': {'unit_price': 'area', 'area': 'unit_price'},
+        'show': ['customer_name', 'unit_price', 'area', 'total_amount'],
+    },
+}
+
+def _maintenance_where(fix, record_ids):
+    # 条件与指定 ID 同时生效；record_ids 为 None 时只按条件
+    if record_ids is None:
+        return f"WHERE {fix['where']}", ()
+    return f"WHERE ({fix['where']}) AND id IN (SELECT value FROM json_each(?))", (json.dumps([int(i) for i in record_ids]),)
+
+def preview_maintenance(fix_key, record_ids=None):
+    # 演练：不修改数据，返回将被修改的记录 (当前值 + 修复后的值)
+    fix = MAINTENANCE_FIXES[fix_key]
+    where, params = _maintenance_where(fix, record_ids)
+    new_values = ", ".join(f"{expr} AS new_{col}" for col, expr in fix['set'].items())
+    with db_conn(DB_FILE) as conn:
+        return pd.read_sql_query(f"SELECT id, {', '.join(fix['show'])}, {new_values} FROM sales {where} ORDER BY id",
+                                 conn, params=params)
+
+def run_maintenance(fix_key, operator, record_ids=None):
+    # 一个事务内：圈定 ID → 只更新这些行 → 写一条审计记录；返回 (修改行数, 修改的 ID 列表)
+    fix = MAINTENANCE_FIXES[fix_key]
+    where, params = _maintenance_where(fix, record_ids)
+    with db_conn(DB_FILE) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        affected_ids = [row[0] for row in conn.execute(f"SELECT id FROM sales {where} ORDER BY id", params)]
+        if not affected_ids:
+            return 0, []
+        assignments = ", ".join(f"{col} = {expr}" for col, expr in fix['set'].items())
+        rows = conn.execute(f"UPDATE sales SET {assignments} WHERE id IN (SELECT value FROM json_each(?))",
+                            (json.dumps(affected_ids),)).rowcount
+        conn.execute("""
+            INSERT INTO maintenance_log (fix, operator, performed_at, predicate, affected_ids, rows)
+            VALUES (?, ?, ?, ?, ?, ?)""",
+            (fix_key, operator, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), where, json.dumps(affected_ids), rows))
+    notify_sales_changed()
+    return rows, affected_ids
+
+def get_maintenance_log(limit=10):
+    with db_conn(DB_FILE) as conn:
+        return pd.read_sql_query(
+            "SELECT id, fix, operator, performed_at, rows, affected_ids FROM maintenance_log ORDER BY id DESC LIMIT ?",
+            conn, params=(limit,))
+
+# --- 销售看板聚合 (读取月度汇总表，结果按数据版本缓存) ---
+# 汇总表由触发器实时维护，行数只与 月份×对接人×店铺×场地×进度×来源 的组合数有关，与线索总数无关
+@st.cache_data(show_spinner=False, max_entries=32)
+def _sales_dashboard_aggregates(version, users_version, current_month):
+    with db_conn(DB_FILE) as conn:
+        def query(sql, params=()):
+            return pd.read_sql_query(sql, conn, params=params)
+
+        totals = query("""
+            SELECT COALESCE(SUM(lead_count), 0) AS leads, COALESCE(SUM(revenue), 0) AS revenue,
+                   COALESCE(SUM(gross_margin), 0) AS margin, COALESCE(SUM(area), 0) AS area,
+                   COALESCE(SUM(shipping), 0) AS shipping,
+                   COALESCE(SUM(CASE WHEN month = ? THEN revenue END), 0) AS month_revenue,
+                   COALESCE(SUM(CASE WHEN month = ? THEN area END), 0) AS month_area
+            FROM sales_monthly_rollup""", (current_month, current_month)).iloc[0].to_dict()
+        monthly = query("""
+            SELECT month AS "月度", SUM(revenue) AS "预估总金额(元)", SUM(gross_margin) AS "毛利", SUM(area) AS "平方数(㎡)"
+            FROM sales_monthly_rollup WHERE month != '' GROUP BY month ORDER BY month""")
+        shop_perf = query("""
+            SELECT shop_name AS "店铺名称", SUM(revenue) AS "预估总金额(元)"
+            FROM sales_monthly_rollup GROUP BY shop_name ORDER BY 2 DESC""")
+        site_perf = query("""
+            SELECT site_type AS "应用场地", SUM(area) AS "平方数(㎡)"
+            FROM sales_monthly_rollup GROUP BY site_type ORDER BY 2 DESC LIMIT 10""")
+        status_counts = query("SELECT status, SUM(lead_count) AS count FROM sales_monthly_rollup GROUP BY status")
+        source_counts = query("""
+            SELECT source, SUM(lead_count) AS count FROM sales_monthly_rollup
+            WHERE source != '' GROUP BY source ORDER BY 2 DESC""")
+        reps_sql, reps_params = rep_name_join('r.sales_rep')
+        leaderboard = query(f"""
+            SELECT {REP_NAME_SQL.format(rep_col='r.sales_rep')} AS sales_rep, SUM(r.revenue) AS revenue
+            FROM sales_monthly_rollup r {reps_sql}
+            WHERE r.status = '已完结/已收款' AND r.month = ?
+            GROUP BY r.sales_rep ORDER BY revenue DESC""", (*reps_params, current_month))
+
+    return {
+        'totals': totals, 'monthly': monthly, 'shop_perf': shop_perf, 'site_perf': site_perf,
+        'status_counts': status_counts, 'source_counts': source_counts, 'leaderboard': leaderboard,
+    }
+
+def get_sales_dashboard(current_month):
+    # 以 sales 数据版本为缓存键：没有写入就不会重新聚合；排行榜带对接人中文名，用户目录变化时也重算
+    return _sales_dashboard_aggregates(data_version('sales'), data_version('users'), current_month)
+
+def rebuild_sales_rollup():
+    # 管理员操作：从 sales 全量重算汇总表 (修正浮点累计误差或手工改库后使用)，返回汇总行数
+    with db_conn(DB_FILE) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        _execute_script(conn, ROLLUP_REBUILD_SQL)
+        rows = conn.execute("SELECT COUNT(*) FROM sales_monthly_rollup").fetchone()[0]
+    notify_sales_changed()
+    return rows
+
+# --- 跟进提醒 (SQL 计算，按数据版本和日期缓存) ---
+@st.cache_data(show_spinner=False, max_entries=8)
+def _follow_up_reminders(version, today):
+    # 日期列存为 'YYYY-MM-DD' 文本，直接做字符串区间比较以走索引；空串/非法值用 GLOB 排除
+    today = datetime.date.fromisoformat(today)
+    overdue_cutoff = (today - datetime.timedelta(days=DAYS_FOR_TRANSFER)).isoformat()
+    due_cutoff = (today + datetime.timedelta(days=1)).isoformat()
+    with db_conn(DB_FILE) as conn:
+        total = conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0]
+        overdue_rows = conn.execute("""
+            SELECT sales_rep, id FROM sales
+            WHERE last_follow_up_date < ? AND last_follow_up_date GLOB '[0-9]*'
+              AND status IS NOT '已完结/已收款'
+            ORDER BY sales_rep, id""", (overdue_cutoff,)).fetchall()
+        due_rows = conn.execute("""
+            SELECT sales_rep, id FROM sales
+            WHERE next_follow_up_date < ? AND next_follow_up_date GLOB '[0-9]*'
+              AND status IS NOT '已完结/已收款'
+            ORDER BY sales_rep, id""", (due_cutoff,)).fetchall()
+
+    def group_by_rep(rows):
+        result = {}
+        for rep, record_id in rows:
+            result.setdefault(rep, []).append(record_id)
+        return result
+
+    return {'total': total, 'overdue': group_by_rep(overdue_rows), 'due': group_by_rep(due_rows)}
+
+def get_follow_up_reminders(today=None):
+    # 返回 {'total': 线索总数, 'overdue': {对接人: [超期 ID]}, 'due': {对接人: [今日及之前待跟进 ID]}}
+    # 缓存键含数据版本和当天日期：有写入或跨天后自动重算
+    today = today or datetime.date.today()
+    return _follow_up_reminders(data_version('sales'), today.isoformat())
 
 # --- 数据库函数 (推广数据) ---
 def init_promo_db():
-    conn = sqlite3.connect(PROMO_DB_FILE)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS promotions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        month TEXT,
-        shop TEXT,
-        promo_type TEXT,
-        total_spend REAL,
-        trans_spend REAL,
-        net_gmv REAL,
-        net_roi REAL,
-        cpa_net REAL,
-        inquiry_count INTEGER,
-        inquiry_spend REAL,
-        cpl REAL,
-        note TEXT
-    )''')
-    conn.commit()
-    conn.close()
+    run_migrations(PROMO_DB_FILE, PROMO_DB_MIGRATIONS)
+
+def notify_promotions_changed():
+    # 推广数据写入后调用：看板聚合与明细缓存随版本号失效
+    get_data_versions().bump('promotions')
 
 def add_promo_data(data):
-    conn = sqlite3.connect(PROMO_DB_FILE)
-    c = conn.cursor()
-    c.execute('''INSERT INTO promotions (
-        month, shop, promo_type, total_spend, trans_spend, net_gmv, 
-        net_roi, cpa_net, inquiry_count, inquiry_spend, cpl, note
-    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', data)
-    conn.commit()
-    conn.close()
-
-def get_promo_data(rename_cols=False):
-    conn = sqlite3.connect(PROMO_DB_FILE)
-    df = pd.read_sql_query("SELECT * FROM promotions", conn)
-    conn.close()
-    
-    # 推广数据列名映射
-    PROMO_COL_MAP = {
-        'id': 'ID', 'month': '月份', 'shop': '店铺', 'promo_type': '推广类型',
-        'total_spend': '总花费(元)', 'trans_spend': '成交花费(元)', 'net_gmv': '净成交额(元)',
-        'net_roi': '净投产比(ROI)', 'cpa_net': '每笔净成交花费(元)', 'inquiry_count': '询单量',
-        'inquiry_spend': '询单花费(元)', 'cpl': '询单成本(元/个)', 'note': '备注'
-    }
+    with db_conn(PROMO_DB_FILE) as conn:
+        conn.execute('''INSERT INTO promotions (
+            month, shop, promo_type, total_spend, trans_spend, net_gmv, 
+            net_roi, cpa_net, inquiry_count, inquiry_spend, cpl, note
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', data)
+    notify_promotions_changed()
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _read_promo_data(version, columns):
+    with db_conn(PROMO_DB_FILE) as conn:
+        return read_sql_typed(conn, 'promotions', list(columns), PROMO_DTYPES, where="ORDER BY id")
+
+def get_promo_data(rename_cols=False, columns=None):
+    # 按推广数据版本缓存，录入/导入后自动失效
+    columns = _check_columns(columns or PROMO_COLUMNS, PROMO_COLUMNS)
+    df = _read_promo_data(data_version('promotions'), tuple(columns))
     
     if rename_cols:
         df.rename(columns=PROMO_COL_MAP, inplace=True)
     return df
 
+# --- 推广看板聚合 (SQL GROUP BY，结果按推广数据版本缓存) ---
+@st.cache_data(show_spinner=False, max_entries=8)
+def _promo_dashboard_aggregates(version):
+    with db_conn(PROMO_DB_FILE) as conn:
+        def query(sql):
+            return pd.read_sql_query(sql, conn)
+
+        row_count = conn.execute("SELECT COUNT(*) FROM promotions").fetchone()[0]
+        monthly = query("""
+            SELECT month AS "月份", SUM(total_spend) AS "总花费(元)", SUM(net_gmv) AS "净成交额(元)",
+                   SUM(inquiry_count) AS "询单量",
+                   COALESCE(SUM(net_gmv) / NULLIF(SUM(total_spend), 0), 0) AS "整体ROI"
+            FROM promotions GROUP BY month ORDER BY month""")
+        shop = query("""
+            SELECT shop AS "店铺", SUM(total_spend) AS "总花费(元)", SUM(net_gmv) AS "净成交额(元)",
+                   COALESCE(SUM(net_gmv) / NULLIF(SUM(total_spend), 0), 0) AS "ROI"
+            FROM promotions GROUP BY shop ORDER BY shop""")
+        # 平均询单成本为各条记录 CPL 的简单平均；加权询单成本 = 询单花费合计 / 询单量合计 (花费越多的记录权重越大)
+        cpl = query("""
+            SELECT month AS "月份", AVG(cpl) AS "询单成本(元/个)",
+                   SUM(inquiry_spend) / NULLIF(SUM(inquiry_count), 0) AS "加权询单成本(元/个)"
+            FROM promotions GROUP BY month ORDER BY month""")
+    return {'row_count': row_count, 'monthly': monthly, 'shop': shop, 'cpl': cpl}
+
+def get_promo_dashboard():
+    return _promo_dashboard_aggregates(data_version('promotions'))
+
+# --- 推广归因 (推广花费 × CRM 实际线索/成交，按 月份+店铺+来源渠道 关联) ---
+# 投放店铺 -> CRM 客户来源；未列出的店铺没有对应的付费渠道，只展示花费
+PROMO_SHOP_CHANNELS = {
+    "天猫旗舰店": "天猫推广",
+    "拼多多运动店铺": "拼多多推广",
+    "拼多多旗舰店": "拼多多推广",
+}
+DEAL_STATUS = "已完结/已收款"
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _promo_attribution(sales_version, promo_version):
+    # 两边先各自按 (月份, 店铺) 聚合再关联：推广表走 (month, shop, ...) 索引，CRM 侧读月度汇总表而不是 sales 明细
+    with db_conn(DB_FILE) as conn:
+        conn.execute("ATTACH DATABASE ? AS promo", (PROMO_DB_FILE,))
+        try:
+            df = pd.read_sql_query("""
+                WITH channels(shop, channel) AS (SELECT key, value FROM json_each(?)),
+                spend AS (
+                    SELECT month, shop, SUM(total_spend) AS spend, SUM(net_gmv) AS reported_gmv,
+                           SUM(inquiry_count) AS inquiries
+                    FROM promo.promotions GROUP BY month, shop
+                ),
+                crm AS (
+                    SELECT r.month, r.shop_name, SUM(r.lead_count) AS leads,
+                           SUM(CASE WHEN r.status = ? THEN r.lead_count ELSE 0 END) AS deals,
+                           SUM(CASE WHEN r.status = ? THEN r.revenue ELSE 0 END) AS deal_revenue
+                    FROM channels c JOIN sales_monthly_rollup r ON r.shop_name = c.shop AND r.source = c.channel
+                    GROUP BY r.month, r.shop_name
+                )
+                SELECT s.month AS "月份", s.shop AS "店铺", COALESCE(c.channel, '') AS "客户来源",
+                       s.spend AS "总花费(元)", s.reported_gmv AS "填报净成交额(元)",
+                       COALESCE(s.reported_gmv / NULLIF(s.spend, 0), 0) AS "填报ROI",
+                       s.inquiries AS "填报询单量",
+                       COALESCE(crm.leads, 0) AS "CRM线索数", COALESCE(crm.deals, 0) AS "CRM成交数",
+                       COALESCE(crm.deal_revenue, 0) AS "CRM成交额(元)",
+                       COALESCE(crm.deal_revenue, 0) / NULLIF(s.spend, 0) AS "实际ROI",
+                       s.spend / NULLIF(crm.deals, 0) AS "每笔成交成本(元)",
+                       s.spend / NULLIF(crm.leads, 0) AS "每条线索成本(元)"
+                FROM spend s
+                LEFT JOIN channels c ON c.shop = s.shop
+                LEFT JOIN crm ON crm.month = s.month AND crm.shop_name = s.shop
+                ORDER BY s.month, s.shop""",
+                conn, params=(json.dumps(PROMO_SHOP_CHANNELS, ensure_ascii=False), DEAL_STATUS, DEAL_STATUS))
+        finally:
+            conn.execute("DETACH DATABASE promo")
+    return df
+
+def get_promo_attribution():
+    # 任一边数据变化都会重新计算
+    return _promo_attribution(data_version('sales'), data_version('promotions'))
+
+# --- 批量导入 (Excel/CSV 分块读取 → 整列校验 → 批量查重 → 分批 executemany) ---
+IMPORT_BATCH_ROWS = 5000
+# 导入时写入 sales 的列，顺序与 add_data 一致
+IMPORT_SALES_COLS = [col for col in SALES_COLUMNS if col != 'id' and col not in SALES_DERIVED_COLS] + SALES_KEY_COLS
+IMPORT_PROMO_COLS = [col for col in PROMO_COLUMNS if col != 'id']
+# 选项列 -> (可选值, 留空时的默认值)
+SALES_IMPORT_OPTIONS = {
+    'source': (SOURCE_OPTIONS, '其他'),
+    'shop_name': (SHOP_OPTIONS, '线下渠道/其他'),
+    'site_type': (SITE_OPTIONS, '其他/未分类'),
+    'status': (STATUS_OPTIONS, '初次接触'),
+    'is_construction': (CONSTRUCTION_OPTIONS, '否'),
+    'purchase_intent': (INTENT_OPTIONS, '中'),
+}
+PROMO_IMPORT_OPTIONS = {
+    'shop': (SHOP_OPTIONS, None),
+    'promo_type': (PROMO_TYPE_OPTIONS, None),
+}
+SALES_IMPORT_NUMBERS = ['unit_price', 'area', 'construction_fee', 'material_fee', 'shipping_fee']
+PROMO_IMPORT_NUMBERS = ['total_spend', 'trans_spend', 'net_gmv', 'net_roi', 'cpa_net', 'inquiry_count', 'inquiry_spend', 'cpl']
+
+def _excel_cell(value):
+    # Excel 中的电话、单号常被存成数字，整数值去掉 ".0"
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def _iter_import_chunks(uploaded_file, file_name):
+    # 逐块读取上传文件，块的索引为文件中的行号 (表头为第 1 行)
+    if file_name.lower().endswith(('.xlsx', '.xlsm')):
+        import openpyxl
+        workbook = openpyxl.load_workbook(uploaded_file, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = [str(col).strip() if col is not None else '' for col in next(rows, ())]
+            batch, start = [], 2
+            for row in rows:
+                batch.append([_excel_cell(v) for v in row])
+                if len(batch) == IMPORT_BATCH_ROWS:
+                    yield pd.DataFrame(batch, columns=header, index=range(start, start + len(batch)))
+                    start += len(batch)
+                    batch = []
+            if batch:
+                yield pd.DataFrame(batch, columns=header, index=range(start, start + len(batch)))
+        finally:
+            workbook.close()
+    else:
+        start = 2
+        for chunk in pd.read_csv(uploaded_file, dtype=str, keep_default_na=False, chunksize=IMPORT_BATCH_ROWS, encoding='utf-8-sig'):
+            chunk.index = range(start, start + len(chunk))
+            start += len(chunk)
+            yield chunk
+
+def _map_import_columns(chunk, col_map):
+    # 表头可以是中文列名或英文字段名；未识别的列忽略
+    lookup = {**{cn: en for en, cn in col_map.items()}, **{en: en for en in col_map}}
+    chunk = chunk.rename(columns=lambda col: lookup.get(str(col).strip(), None))
+    return chunk.loc[:, [col for col in chunk.columns if col is not None]]
+
+def _import_text(chunk, col):
+    if col not in chunk.columns:
+        return pd.Series('', index=chunk.index)
+    return chunk[col].fillna('').astype(str).str.strip()
+
+def _add_import_error(errors, mask, message):
+    errors[mask] = errors[mask] + message + "；"
+
+def _import_options(chunk, col, options, default, label, errors):
+    values = _import_text(chunk, col)
+    if default is not None:
+        values = values.mask(values == '', default)
+    _add_import_error(errors, ~values.isin(options), f"{label}不在可选项中")
+    return values
+
+def _import_numbers(chunk, cols, col_map, errors):
+    result = {}
+    for col in cols:
+        raw = _import_text(chunk, col)
+        values = pd.to_numeric(raw.str.replace(',', '', regex=False), errors='coerce')
+        _add_import_error(errors, values.isna() & (raw != ''), f"{col_map[col]}不是数字")
+        result[col] = values.fillna(0)
+    return result
+
+def _import_dates(chunk, col, default, label, errors, fmt='%Y-%m-%d'):
+    raw = _import_text(chunk, col)
+    values = pd.to_datetime(raw.mask(raw == ''), format='mixed', errors='coerce')
+    _add_import_error(errors, values.isna() & (raw != ''), f"{label}不是有效日期")
+    return values.dt.strftime(fmt).fillna(default)
+
+def _import_columns(rows, cols):
+    # 按列转为 Python 列表 (比逐行 itertuples 快得多，数值也转成 sqlite3 可绑定的内置类型)
+    return [rows[col].tolist() for col in cols]
+
+def _import_param_rows(rows, cols):
+    return zip(*_import_columns(rows, cols))
+
+def _import_report_rows(errors, chunk, name_col):
+    failed = errors[errors != '']
+    return pd.DataFrame({'行号': failed.index, '名称': _import_text(chunk, name_col)[failed.index].values,
+                         '错误原因': failed.str.rstrip('；').values})
+
+def import_sales(uploaded_file, file_name, importer, importer_display_name, importer_role, user_map):
+    # 返回 {'inserted': 导入行数, 'errors': 逐行错误报告 DataFrame, 'elapsed_ms': 耗时}
+    # 与录入表单一致：非管理员只能导入到自己名下
+    started = time.perf_counter()
+    display_to_user = {name: username for username, name in user_map.items()}
+    today = datetime.date.today()
+    inserted, reports = 0, []
+    for chunk in _iter_import_chunks(uploaded_file, file_name):
+        chunk = _map_import_columns(chunk, CRM_COL_MAP)
+        errors = pd.Series('', index=chunk.index)
+        rows = pd.DataFrame(index=chunk.index)
+
+        rows['customer_name'] = _import_text(chunk, 'customer_name')
+        _add_import_error(errors, rows['customer_name'] == '', "客户名称为空")
+        rows['phone'] = _import_text(chunk, 'phone')
+        # 对接人可填账号或中文名，留空归导入人
+        reps = _import_text(chunk, 'sales_rep')
+        reps = reps.map(display_to_user).fillna(reps).mask(reps == '', importer)
+        _add_import_error(errors, ~reps.isin(list(user_map)), "对接人不存在")
+        if importer_role != 'admin':
+            _add_import_error(errors, reps.isin(list(user_map)) & (reps != importer), "只能导入由您负责的客户")
+        rows['sales_rep'] = reps
+        for col, (options, default) in SALES_IMPORT_OPTIONS.items():
+            rows[col] = _import_options(chunk, col, options, default, CRM_COL_MAP[col], errors)
+        numbers = _import_numbers(chunk, SALES_IMPORT_NUMBERS, CRM_COL_MAP, errors)
+        for col, values in numbers.items():
+            rows[col] = values
+        rows['date'] = _import_dates(chunk, 'date', today.isoformat(), CRM_COL_MAP['date'], errors)
+        rows['last_follow_up_date'] = _import_dates(chunk, 'last_follow_up_date', today.isoformat(), CRM_COL_MAP['last_follow_up_date'], errors)
+        rows['next_follow_up_date'] = _import_dates(chunk, 'next_follow_up_date', (today + datetime.timedelta(days=3)).isoformat(),
+                                                    CRM_COL_MAP['next_follow_up_date'], errors)
+        rows['sample_no'] = _import_text(chunk, 'sample_no')
+        rows['order_no'] = _import_text(chunk, 'order_no')
+        first_logs = _import_text(chunk, 'follow_up_history').mask(lambda s: s == '', f"批量导入：{file_name}")
+
+        # 查重：按规范化键查文件内重复 + 与已有客户重复 (客户名或非空电话)，一次查询覆盖整块
+        rows['name_norm'] = normalize_names(rows['customer_name'])
+        rows['phone_norm'] = normalize_phones(rows['phone'])
+        _add_import_error(errors, rows['name_norm'].duplicated() & (rows['name_norm'] != ''), "文件内客户名称重复")
+        _add_import_error(errors, rows['phone_norm'].duplicated() & (rows['phone_norm'] != ''), "文件内电话重复")
+
+        now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M')
+        with db_conn(DB_FILE) as conn:
+            # 与已有客户的查重在写锁内进行，查重到插入之间其他人无法录入同一个客户
+            conn.execute("BEGIN IMMEDIATE")
+            owner = find_duplicate_customers(rows['customer_name'], rows['phone'], conn=conn)['match_rep']
+            for rep in owner.dropna().unique():
+                _add_import_error(errors, owner == rep, f"客户已存在，目前由 {user_map.get(rep, rep)} 负责")
+
+            valid = rows[errors == '']
+            if not valid.empty:
+                # AUTOINCREMENT 保证新 ID 递增，持有写锁期间新行的 ID 与插入顺序一一对应
+                before_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM sales").fetchone()[0]
+                conn.executemany(
+                    f"INSERT INTO sales ({', '.join(IMPORT_SALES_COLS)}) VALUES ({', '.join('?' * len(IMPORT_SALES_COLS))})",
+                    _import_param_rows(valid, IMPORT_SALES_COLS))
+                new_ids = [row[0] for row in conn.execute("SELECT id FROM sales WHERE id > ? ORDER BY id", (before_id,))]
+                conn.executemany(
+                    "INSERT INTO follow_ups (record_id, timestamp, author, text, next_date, status, intent) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    zip(new_ids, [now] * len(new_ids), [importer_display_name] * len(new_ids), first_logs[valid.index].tolist(),
+                        *_import_columns(valid, ['next_follow_up_date', 'status', 'purchase_intent'])))
+            inserted += len(valid)
+        reports.append(_import_report_rows(errors, chunk, 'customer_name'))
+
+    if inserted:
+        notify_sales_changed()
+    errors = pd.concat(reports, ignore_index=True) if reports else pd.DataFrame(columns=['行号', '名称', '错误原因'])
+    return {'inserted': inserted, 'errors': errors, 'elapsed_ms': (time.perf_counter() - started) * 1000}
+
+def import_promotions(uploaded_file, file_name):
+    started = time.perf_counter()
+    inserted, reports = 0, []
+    for chunk in _iter_import_chunks(uploaded_file, file_name):
+        chunk = _map_import_columns(chunk, PROMO_COL_MAP)
+        errors = pd.Series('', index=chunk.index)
+        rows = pd.DataFrame(index=chunk.index)
+        # 月份统一为 'YYYY-MM'，可以填具体日期
+        rows['month'] = _import_dates(chunk, 'month', '', PROMO_COL_MAP['month'], errors, fmt='%Y-%m')
+        _add_import_error(errors, _import_text(chunk, 'month') == '', "月份为空")
+        for col, (options, default) in PROMO_IMPORT_OPTIONS.items():
+            rows[col] = _import_options(chunk, col, options, default, PROMO_COL_MAP[col], errors)
+        for col, values in _import_numbers(chunk, PROMO_IMPORT_NUMBERS, PROMO_COL_MAP, errors).items():
+            rows[col] = values
+        rows['inquiry_count'] = rows['inquiry_count'].round().astype('int64')
+        rows['note'] = _import_text(chunk, 'note')
+
+        valid = rows[errors == '']
+        if not valid.empty:
+            with db_conn(PROMO_DB_FILE) as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    f"INSERT INTO promotions ({', '.join(IMPORT_PROMO_COLS)}) VALUES ({', '.join('?' * len(IMPORT_PROMO_COLS))})",
+                    _import_param_rows(valid, IMPORT_PROMO_COLS))
+            inserted += len(valid)
+        reports.append(_import_report_rows(errors, chunk, 'shop'))
+
+    if inserted:
+        notify_promotions_changed()
+    errors = pd.concat(reports, ignore_index=True) if reports else pd.DataFrame(columns=['行号', '名称', '错误原因'])
+    return {'inserted': inserted, 'errors': errors, 'elapsed_ms': (time.perf_counter() - started) * 1000}
+
+def render_import_result(result):
+    st.success(f"已导入 {result['inserted']} 行，耗时 {result['elapsed_ms']:.0f} ms。")
+    if not result['errors'].empty:
+        st.warning(f"⚠️ {len(result['errors'])} 行未导入，原因如下：")
+        st.dataframe(result['errors'], hide_index=True, use_container_width=True)
+        st.download_button("📥 下载错误报告 (CSV)", result['errors'].to_csv(index=False).encode('utf-8-sig'),
+                           file_name='import_errors.csv', mime='text/csv', on_click='ignore')
+
+# --- 数据导出 (分块读取写入临时文件，按数据版本缓存) ---
+EXPORT_CHUNK_ROWS = 5000
+# 格式名 -> (扩展名, MIME)
+EXPORT_FORMATS = {
+    'Excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'CSV (gzip)': ('csv.gz', 'application/gzip'),
+}
+if pq is not None:
+    EXPORT_FORMATS['Parquet'] = ('parquet', 'application/vnd.apache.parquet')
+
+def _read_export_chunk(conn, table, columns, dtypes, params):
+    # 备份导出保留库中原值：不用 read_sql_typed (空金额会填 0、无法解析的日期会变空)，数值列只统一成可空类型，日期保持原文本
+    return pd.read_sql_query(f"SELECT {', '.join(columns)} FROM {table} WHERE id > ? ORDER BY id LIMIT ?", conn, params=params,
+                             dtype={col: 'Int64' if dtype == 'int64' else 'float64' for col, dtype in dtypes.items()})
+
+def _iter_sales_export_chunks():
+    # 按 ID 顺序分块读取，同一个读事务保证各块来自同一快照；跟进历史只取当前块的客户；对接人导出为中文名
+    reps_sql, reps_params = rep_name_join()
+    with db_conn(DB_FILE) as conn:
+        conn.execute("BEGIN")
+        last_id = 0
+        while True:
+            chunk = _read_export_chunk(conn, f"sales {reps_sql}", rep_name_columns(SALES_COLUMNS), SALES_DTYPES,
+                                       (*reps_params, last_id, EXPORT_CHUNK_ROWS))
+            if chunk.empty:
+                return
+            last_id = int(chunk['id'].iloc[-1])
+            chunk['follow_up_history'] = chunk['id'].map(get_follow_up_history_text(chunk['id'].tolist(), conn))
+            chunk = chunk.rename(columns=CRM_COL_MAP)
+            yield chunk
+
+def _iter_promo_export_chunks():
+    with db_conn(PROMO_DB_FILE) as conn:
+        conn.execute("BEGIN")
+        last_id = 0
+        while True:
+            chunk = _read_export_chunk(conn, 'promotions', PROMO_COLUMNS, PROMO_DTYPES, (last_id, EXPORT_CHUNK_ROWS))
+            if chunk.empty:
+                return
+            last_id = int(chunk['id'].iloc[-1])
+            yield chunk.rename(columns=PROMO_COL_MAP)
+
+def _write_excel(chunks, path):
+    # constant_memory 模式按行顺序落盘，内存中只保留当前行
+    import xlsxwriter
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd'})
+    worksheet = workbook.add_worksheet('Sheet1')
+    row_idx = 0
+    for chunk in chunks:
+        if row_idx == 0:
+            worksheet.write_row(0, 0, list(chunk.columns))
+            row_idx = 1
+        # 空值 (NaN/NaT) 写成空单元格
+        values = chunk.astype(object).where(chunk.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            worksheet.write_row(row_idx, 0, row)
+            row_idx += 1
+    workbook.close()
+    return max(row_idx - 1, 0)
+
+def _write_csv_gzip(chunks, path):
+    rows = 0
+    # utf-8-sig 让 Excel 直接识别中文
+    with gzip.open(path, 'wt', encoding='utf-8-sig', newline='') as f:
+        for chunk in chunks:
+            chunk.to_csv(f, header=rows == 0, index=False, date_format='%Y-%m-%d')
+            rows += len(chunk)
+    return rows
+
+def _write_parquet(chunks, path):
+    writer, rows = None, 0
+    try:
+        for chunk in chunks:
+            if writer is None:
+                # 首块中全为空的文本列会被推断为 null 类型，统一按字符串处理以便后续块写入
+                schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+                schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in schema])
+                writer = pq.ParquetWriter(path, schema)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False))
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+EXPORT_WRITERS = {'Excel': _write_excel, 'CSV (gzip)': _write_csv_gzip, 'Parquet': _write_parquet}
+
+# 导出文件含完整客户资料：进程正常退出时删除本进程的导出目录；异常退出留下的目录在下次启动时按修改时间清理
+EXPORT_DIR_PREFIX = 'crm_export_'
+EXPORT_DIR_STALE = datetime.timedelta(hours=24)
+
+def _purge_stale_export_dirs():
+    cutoff = time.time() - EXPORT_DIR_STALE.total_seconds()
+    with os.scandir(tempfile.gettempdir()) as entries:
+        for entry in entries:
+            if entry.name.startswith(EXPORT_DIR_PREFIX) and entry.is_dir(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+class ExportCache:
+    # 每种 (数据, 格式) 只保留一个导出文件；数据版本没变时直接复用，变了才重新生成并删除旧文件
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files = {}
+        _purge_stale_export_dirs()
+        self.export_dir = tempfile.mkdtemp(prefix=EXPORT_DIR_PREFIX)
+        atexit.register(shutil.rmtree, self.export_dir, ignore_errors=True)
+
+    def get(self, kind, fmt, version, make_chunks):
+        with self._lock:
+            cached = self._files.get((kind, fmt))
+            if cached and cached[0] == version and os.path.exists(cached[1]):
+                return cached[1], cached[2]
+            # 长时间没有导出的进程，目录可能已被其他进程按过期清理
+            os.makedirs(self.export_dir, exist_ok=True)
+            fd, path = tempfile.mkstemp(suffix='.' + EXPORT_FORMATS[fmt][0], dir=self.export_dir)
+            os.close(fd)
+            try:
+                rows = EXPORT_WRITERS[fmt](make_chunks(), path)
+            except Exception:
+                os.remove(path)
+                raise
+            if cached and os.path.exists(cached[1]):
+                os.remove(cached[1])
+            self._files[(kind, fmt)] = (version, path, rows)
+            return path, rows
+
+@st.cache_resource
+def get_export_cache():
+    return ExportCache()
+
+def export_sales(fmt):
+    # 返回 (导出文件路径, 行数)；用户目录版本也参与缓存键 (对接人导出为中文名)
+    version = (data_version('sales'), data_version('users'))
+    return get_export_cache().get('sales', fmt, version, _iter_sales_export_chunks)
+
+def export_promotions(fmt):
+    return get_export_cache().get('promotions', fmt, data_version('promotions'), _iter_promo_export_chunks)
+
+# --- 后台任务 (线程池执行，状态持久化在 jobs 表，结果文件按期清理) ---
+JOB_WORKERS = 2
+# 结果文件放在程序所在目录下 (与启动时的工作目录无关)，重启后仍可按 jobs 表中的路径下载
+JOB_RESULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'job_results')
+JOB_RESULT_TTL = datetime.timedelta(hours=24)
+JOB_POLL_SECONDS = 3
+JOB_ACTIVE_STATUSES = ('queued', 'running')
+JOB_STATUS_LABELS = {'queued': '⏳ 排队中', 'running': '⚙️ 执行中', 'done': '✅ 已完成', 'failed': '❌ 失败', 'expired': '🗑️ 已过期'}
+
+def _job_now():
+    return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _job_export(job_id, params):
+    # 复用导出缓存，再复制一份作为任务结果，避免数据更新后缓存文件被替换
+    if params['table'] == 'sales':
+        path, rows = export_sales(params['format'])
+    else:
+        path, rows = export_promotions(params['format'])
+    if not rows:
+        raise ValueError("暂无数据可导出")
+    result_path = os.path.join(JOB_RESULT_DIR, f"job_{job_id}.{EXPORT_FORMATS[params['format']][0]}")
+    shutil.copyfile(path, result_path)
+    return result_path, rows, f"共导出 {rows} 行"
+
+def _job_rebuild_rollup(job_id, params):
+    rows = rebuild_sales_rollup()
+    return None, rows, f"月度汇总表已重建，共 {rows} 行"
+
+def _job_maintenance(job_id, params):
+    rows, _ = run_maintenance(params['fix'], params['operator'], params.get('record_ids'))
+    return None, rows, f"{MAINTENANCE_FIXES[params['fix']]['label']}：共修改 {rows} 条记录"
+
+# 任务类型 -> (显示名, 处理函数)；处理函数返回 (结果文件路径或 None, 行数, 说明)
+JOB_KINDS = {
+    'export': ('数据导出', _job_export),
+    'rebuild_rollup': ('重建月度汇总表', _job_rebuild_rollup),
+    'maintenance': ('数据维护', _job_maintenance),
+}
+
+class JobRunner:
+    def __init__(self, workers=JOB_WORKERS):
+        os.makedirs(JOB_RESULT_DIR, exist_ok=True)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='crm-job')
+
+    def submit(self, kind, params, owner):
+        if kind not in JOB_KINDS:
+            raise ValueError(f"未知任务类型: {kind}")
+        with db_conn(DB_FILE) as conn:
+            job_id = conn.execute("INSERT INTO jobs (kind, params, owner, created_at) VALUES (?, ?, ?, ?)",
+                                  (kind, json.dumps(params, ensure_ascii=False), owner, _job_now())).lastrowid
+        self._executor.submit(self._run, job_id, kind, params)
+        return job_id
+
+    def _run(self, job_id, kind, params):
+        with db_conn(DB_FILE) as conn:
+            conn.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (_job_now(), job_id))
+        try:
+            result_path, rows, message = JOB_KINDS[kind][1](job_id, params)
+        except Exception as e:
+            with db_conn(DB_FILE) as conn:
+                conn.execute("UPDATE jobs SET status = 'failed', finished_at = ?, message = ? WHERE id = ?",
+                             (_job_now(), str(e), job_id))
+            return
+        expires_at = (datetime.datetime.now() + JOB_RESULT_TTL).strftime('%Y-%m-%d %H:%M:%S')
+        with db_conn(DB_FILE) as conn:
+            conn.execute("""
+                UPDATE jobs SET status = 'done', finished_at = ?, expires_at = ?, result_path = ?, result_rows = ?, message = ?
+                WHERE id = ?""", (_job_now(), expires_at, result_path, rows, message, job_id))
+
+@st.cache_resource
+def get_job_runner():
+    return JobRunner()
+
+def submit_job(kind, params, owner):
+    return get_job_runner().submit(kind, params, owner)
+
+def fail_interrupted_jobs():
+    # 启动时调用：上个进程留下的排队/执行中任务已无人执行，标记为失败
+    with db_conn(DB_FILE) as conn:
+        conn.execute("UPDATE jobs SET status = 'failed', finished_at = ?, message = '服务重启，任务已中断' WHERE status IN (?, ?)",
+                     (_job_now(), *JOB_ACTIVE_STATUSES))
+
+def purge_expired_jobs():
+    # 删除过期的结果文件，任务记录保留并标记为已过期
+    with db_conn(DB_FILE) as conn:
+        expired = conn.execute("SELECT id, result_path FROM jobs WHERE status = 'done' AND expires_at < ?", (_job_now(),)).fetchall()
+        for job_id, result_path in expired:
+            if result_path and os.path.exists(result_path):
+                os.remove(result_path)
+        conn.executemany("UPDATE jobs SET status = 'expired', result_path = NULL WHERE id = ?", [(job_id,) for job_id, _ in expired])
+
+def list_jobs(owner, limit=5):
+    purge_expired_jobs()
+    with db_conn(DB_FILE) as conn:
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute("SELECT * FROM jobs WHERE owner = ? ORDER BY id DESC LIMIT ?", (owner, limit)).fetchall()
+        conn.row_factory = None
+    jobs = [dict(row) for row in rows]
+    for job in jobs:
+        job['params'] = json.loads(job['params'])
+    return jobs
+
+def _job_result_reader(path):
+    def read():
+        with open(path, 'rb') as f:
+            return f.read()
+    return read
+
+def _job_panel(owner, was_active):
+    jobs = list_jobs(owner)
+    for job in jobs:
+        title = JOB_KINDS.get(job['kind'], (job['kind'],))[0]
+        st.caption(f"#{job['id']} {title} · {JOB_STATUS_LABELS.get(job['status'], job['status'])}")
+        if job['status'] == 'done' and job['result_path'] and os.path.exists(job['result_path']):
+            # 传入函数：点击下载时才读取文件，面板刷新和轮询不会把结果文件读进内存
+            st.download_button(f"📥 下载 ({job['result_rows']} 行)", data=_job_result_reader(job['result_path']),
+                               file_name=job['params'].get('file_name'), mime=job['params'].get('mime'),
+                               key=f"job_download_{job['id']}", on_click='ignore')
+        elif job['status'] == 'done' and job['result_path']:
+            st.caption("结果文件已被清理，请重新提交任务。")
+        elif job['message'] and job['status'] in ('done', 'failed'):
+            st.caption(job['message'])
+    # 轮询期间任务全部结束：整页刷新一次以显示最新数据，并停止轮询
+    if was_active and not any(job['status'] in JOB_ACTIVE_STATUSES for job in jobs):
+        st.rerun()
+
+def render_job_panel(owner):
+    # 有未完成任务时每隔几秒只刷新任务面板，不重跑整页
+    jobs = list_jobs(owner)
+    if not jobs:
+        return
+    active = any(job['status'] in JOB_ACTIVE_STATUSES for job in jobs)
+    st.markdown("#### 📋 后台任务")
+    st.fragment(_job_panel, run_every=JOB_POLL_SECONDS if active else None)(owner, active)
+
+# --- 启动初始化 (每个进程只执行一次) ---
+# 启动时校验的表结构：数据库 -> 表 -> 必需列
+EXPECTED_SCHEMA = {
+    USER_DB_FILE: {'users': ['username', 'password', 'role', 'display_name']},
+    DB_FILE: {
+        'sales': SALES_COLUMNS + SALES_KEY_COLS,
+        'follow_ups': ['record_id', 'timestamp', 'author', 'text', 'next_date', 'status', 'intent'],
+        'jobs': ['kind', 'params', 'owner', 'status', 'created_at', 'expires_at', 'result_path', 'result_rows', 'message'],
+        'maintenance_log': ['fix', 'operator', 'performed_at', 'predicate', 'affected_ids', 'rows'],
+    },
+    PROMO_DB_FILE: {'promotions': PROMO_COLUMNS},
+}
+
+def validate_schema():
+    problems = []
+    for db_file, tables in EXPECTED_SCHEMA.items():
+        with db_conn(db_file) as conn:
+            for table, columns in tables.items():
+                existing = {row[1] for row in conn.execute(f"PRAGMA table_xinfo({table})")}
+                missing = [col for col in columns if col not in existing]
+                if missing:
+                    problems.append(f"{db_file}/{table} 缺少列: {', '.join(missing)}")
+    if problems:
+        raise RuntimeError("数据库结构校验失败 -> " + "; ".join(problems))
+
+@st.cache_resource
+def bootstrap_databases():
+    # 迁移 + 初始账号 + 结构校验；结果跨 rerun 和会话缓存，失败时不缓存，下次 rerun 会重试
+    started = time.perf_counter()
+    init_user_db()
+    init_db()
+    init_promo_db()
+    validate_schema()
+    fail_interrupted_jobs()
+    versions = {}
+    for db_file in (USER_DB_FILE, DB_FILE, PROMO_DB_FILE):
+        with db_conn(db_file) as conn:
+            versions[db_file] = conn.execute("PRAGMA user_version").fetchone()[0]
+    return {'elapsed_ms': (time.perf_counter() - started) * 1000, 'schema_versions': versions}
+
 # --- 登录逻辑 ---
 def check_password():
     def password_entered():
@@ -328,12 +1901,423 @@ def check_password():
     else:
         return True
 
+# --- 页面片段 (st.fragment：片段内的组件交互只重跑该片段) ---
+# 片段之间不共享局部变量，各自从按数据版本缓存的查询取数；会影响其他片段的写入操作 (接管、删除、修改、新增用户等) 之后整页刷新
+@st.fragment
+def _follow_up_panel(user_role, current_user, current_display_name):
+    with st.expander("➕ 快速追加跟进记录"):
+        col_up1, col_up2 = st.columns([1, 2])
+        with col_up1:
+            # 输入关键词后只查询最匹配的前几个客户，不再为全部客户生成下拉选项
+            picker_term = st.text_input("🔍 搜索客户 (ID/名称/电话)", key="up_search")
+            choices = find_customers(picker_term)
+            if not choices.empty:
+                up_id = st.selectbox("选择客户 ID 和名称", choices.index.tolist(),
+                                     format_func=lambda i: choices.at[i, 'label'])
+            else:
+                st.caption("没有匹配的客户")
+                up_id = None
+        with col_up2:
+            up_content = st.text_input("本次跟进情况")
+
+        col_up3, col_up4, col_up5 = st.columns(3)
+        with col_up3:
+            up_next_date = st.date_input("下次跟进时间", datetime.date.today() + datetime.timedelta(days=3))
+        with col_up4:
+            up_status = st.selectbox("更新进度状态", STATUS_OPTIONS, key="up_stat")
+        with col_up5:
+            up_intent = st.selectbox("更新购买意向", INTENT_OPTIONS, key="up_int")
+
+        if st.button("🚀 提交跟进更新"):
+            if up_id is None:
+                 st.error("请先选择客户。")
+            elif up_id in choices.index:
+               # 候选表中的 sales_rep 是原始 username
+               record_rep_username = choices.at[up_id, 'sales_rep']
+
+               if user_role == 'admin' or record_rep_username == current_user:
+                   update_follow_up(up_id, up_content, str(up_next_date), up_status, up_intent, author=current_display_name)
+                   st.success("跟进记录已追加！")
+                   # 不整页刷新：只显示这条记录的最新状态，下方的提醒计数在本次片段运行中重新读取
+                   record = get_single_record(up_id)
+                   st.dataframe(pd.DataFrame([{CRM_COL_MAP[col]: record[col] for col in
+                                               ('id', 'customer_name', 'status', 'purchase_intent', 'last_follow_up_date', 'next_follow_up_date')}]),
+                                hide_index=True, use_container_width=True)
+               else:
+                   st.error("无权限操作非本人客户记录。")
+            else:
+                st.error("ID 不存在")
+
+    st.markdown("---")
+
+    # 超期/待办提醒由 SQL 计算并缓存，不加载整表
+    reminders = get_follow_up_reminders()
+    # 超期转交逻辑
+    overdue_ids = [i for ids in reminders['overdue'].values() for i in ids]
+    if user_role == 'admin' and overdue_ids:
+        st.error(f"⚠️ 管理员注意：有 {len(overdue_ids)} 个客户超 {DAYS_FOR_TRANSFER} 天未跟进！")
+        if st.button("🔥 一键接管所有超期客户"):
+            # 必须使用原始ID进行转交；一次事务批量完成
+            st.session_state['takeover_result'] = transfer_sales_reps(overdue_ids, 'admin')
+            # 接管改变了列表数据：整页刷新，结果在刷新后显示
+            st.rerun()
+    takeover_result = st.session_state.pop('takeover_result', None)
+    if takeover_result:
+        rows, elapsed_ms = takeover_result
+        st.success(f"已将 {rows} 个客户转入管理员名下 (耗时 {elapsed_ms:.0f} ms)")
+
+    # 提醒逻辑
+    my_reminders = reminders['due'].get(current_user, [])
+    if my_reminders:
+        st.warning(f"🔔 {current_display_name}，您今天有 {len(my_reminders)} 个待办跟进！")
+
+@st.fragment
+def _sales_grid_panel(user_map):
+    # 筛选、排序、翻页和选中行只重跑客户列表
+    col_filter_month, col_filter_rep, col_search = st.columns(3)
+
+    with col_filter_month:
+        month_labels = {m: f"{m[:4]}年{m[5:7]}月" for m in get_sales_months()}
+        filter_month = st.selectbox("🗓️ 录入月份筛选", ['全部月份'] + list(month_labels),
+                                    format_func=lambda m: month_labels.get(m, m))
+
+    with col_filter_rep:
+        rep_display_options = ['全部'] + list(user_map.values())
+        filter_rep_display = st.selectbox("👤 对接人筛选", rep_display_options)
+
+    with col_search:
+        search_term = st.text_input("🔍 搜客户、电话、店铺、单号或跟进内容",
+                                    help=f"客户信息和跟进内容各取最新的 {SEARCH_MATCH_LIMIT} 条命中，命中太多时请输入更具体的关键词")
+
+    col_sort, col_page_size = st.columns(2)
+    with col_sort:
+        sort_key = st.selectbox("↕️ 排序", list(SALES_SORT_OPTIONS),
+                                help="有搜索词时，“最新录入”按相关度排序")
+    with col_page_size:
+        page_size = st.selectbox("每页行数", [20, 50, 100, 200], index=1)
+
+    # 筛选基于中文名，查询时换回 username
+    rep_username = None
+    if filter_rep_display != '全部':
+        rep_username = next((u for u, name in user_map.items() if name == filter_rep_display), None)
+
+    # 只取当前页的数据；页码控件在表格下方，这里先读取上一次选择的页码
+    filters = dict(month=None if filter_month == '全部月份' else filter_month,
+                   sales_rep=rep_username, search_term=search_term, sort_key=sort_key)
+    # 筛选条件 (含每页行数) 变化后回到第 1 页
+    filter_key = (*filters.values(), page_size)
+    if st.session_state.get('crm_filter_key') != filter_key:
+        st.session_state['crm_filter_key'] = filter_key
+        st.session_state['crm_page'] = 1
+    page = st.session_state.get('crm_page', 1)
+    df_final, total_rows = query_sales_page(**filters, page=page, page_size=page_size)
+    page_count = max((total_rows + page_size - 1) // page_size, 1)
+    if page > page_count:
+        # 筛选后总页数变少：回到最后一页
+        page = st.session_state['crm_page'] = page_count
+        df_final, total_rows = query_sales_page(**filters, page=page, page_size=page_size)
+    df_final = df_final.rename(columns=CRM_COL_MAP)
+
+
+    # 定义 Streamlit 列配置
+    st_col_config = {
+       "ID": st.column_config.NumberColumn("ID"),
+       "录入日期": st.column_config.DateColumn("录入日期"),
+       "对接人": st.column_config.TextColumn("👤 对接人"),
+       "客户名称": st.column_config.TextColumn("客户名称"),
+       "联系电话": st.column_config.TextColumn("联系电话"),
+       "客户来源": st.column_config.TextColumn("客户来源"),
+       "店铺名称": st.column_config.TextColumn("店铺名称"),
+       "单价(元/㎡)": st.column_config.NumberColumn("单价(元/㎡)", format="%.2f"),
+       "平方数(㎡)": st.column_config.NumberColumn("平方数(㎡)", format="%.2f"),
+       "应用场地": st.column_config.TextColumn("应用场地"),
+       "跟踪进度": st.column_config.TextColumn("跟踪进度"),
+       "是否施工": st.column_config.TextColumn("是否施工"),
+       "施工费(元)": st.column_config.NumberColumn("施工费(元)", format="%.2f"),
+       "辅料费(元)": st.column_config.NumberColumn("辅料费(元)", format="%.2f"),
+       "运费(元)": st.column_config.NumberColumn("运费(元)", format="%.2f"), # 运费单独列
+       "购买意向": st.column_config.TextColumn("购买意向"),
+       "预估总金额(元)": st.column_config.NumberColumn("预估总金额(元)", format="¥%.2f", help="不含运费的总金额"),
+       "毛利(元)": st.column_config.NumberColumn("毛利(元)", format="¥%.2f", help="预估总金额 - 施工费 - 辅料费"),
+       "实际含运费总额(元)": st.column_config.NumberColumn("实际含运费总额(元)", format="¥%.2f"),
+       "寄样单号": st.column_config.TextColumn("寄样单号"),
+       "订单号": st.column_config.TextColumn("订单号"),
+       "上次跟进日期": st.column_config.DateColumn("上次跟进"),
+       "计划下次跟进": st.column_config.DateColumn("计划下次"),
+    }
+
+    # 确保只选择 CRM_COL_MAP 中定义的中文列名
+    display_cols = list(CRM_COL_MAP.values())
+    df_display = df_final[[c for c in display_cols if c in df_final.columns]]
+
+    # 🚨 最终显示 (跟进历史不随列表加载，选中某一行后再单独读取)
+    grid_event = st.dataframe(
+        df_display,
+        hide_index=True,
+        use_container_width=True,
+        column_config=st_col_config,
+        on_select="rerun",
+        selection_mode="single-row",
+        key="crm_grid"
+    )
+
+    if grid_event.selection.rows:
+        selected = df_display.iloc[grid_event.selection.rows[0]]
+        st.markdown(f"#### 📜 跟进历史：{selected['ID']} - {selected['客户名称']}")
+        df_history = get_follow_ups(selected['ID'])
+        if not df_history.empty:
+            df_history.columns = ['时间', '记录人', '跟进内容', '计划下次', '进度', '意向']
+            st.dataframe(df_history, hide_index=True, use_container_width=True)
+        else:
+            st.info("该客户暂无跟进记录。")
+    else:
+        st.caption("💡 点选表格中的一行即可查看该客户的跟进历史。")
+
+    col_page_info, col_page = st.columns([3, 1])
+    with col_page_info:
+        st.caption(f"共 {total_rows} 条记录，当前第 {page}/{page_count} 页")
+    with col_page:
+        st.number_input(f"页码 (共 {page_count} 页)", min_value=1, max_value=page_count, step=1, key='crm_page')
+
+@st.fragment
+def _admin_record_panel():
+    col_user, col_del, col_edit = st.columns(3)
+
+    with col_user:
+        with st.expander("👤 用户管理"):
+            with st.form("add_user"):
+                nu = st.text_input("用户名")
+                npw = st.text_input("密码", type="password")
+                ndn = st.text_input("中文名")
+                nr = st.selectbox("角色", ['user', 'admin'])
+                if st.form_submit_button("添加"):
+                    if add_new_user(nu, npw, nr, ndn):
+                        st.success("成功")
+                        st.rerun()
+                    else: st.error("失败")
+            st.dataframe(get_all_users(), hide_index=True)
+
+    with col_del:
+        with st.expander("🗑️ 删除记录"):
+            d_id = st.number_input("ID", min_value=1, key="del_id")
+            if st.button("删除"):
+                delete_data(d_id)
+                st.success("已删除")
+                st.rerun()
+
+    with col_edit:
+        with st.expander("📝 修改基本信息(不含运费)"):
+            u_id = st.number_input("ID", min_value=1, key="edit_id")
+            if st.button("加载"):
+                record = get_single_record(u_id) # 获取的是英文列名数据
+                if record: 
+                    st.session_state['edit_record'] = record
+                    st.success("记录已加载，请修改并提交。")
+                else: st.error("不存在")
+
+            # 注意：这里 record['key'] 依然是英文数据库列名
+            if 'edit_record' in st.session_state and st.session_state['edit_record']['id'] == u_id:
+                record = st.session_state['edit_record']
+                with st.form("admin_edit"):
+                    nn = st.text_input("客户名", record['customer_name'])
+                    nph = st.text_input("电话", record['phone'])
+                    # 使用中文名作为 key，方便理解
+                    ns = st.selectbox(CRM_COL_MAP['source'], SOURCE_OPTIONS, index=SOURCE_OPTIONS.index(record['source']) if record['source'] in SOURCE_OPTIONS else 0)
+                    nshop = st.selectbox(CRM_COL_MAP['shop_name'], SHOP_OPTIONS, index=SHOP_OPTIONS.index(record['shop_name']) if record['shop_name'] in SHOP_OPTIONS else 0)
+                    nsite = st.selectbox(CRM_COL_MAP['site_type'], SITE_OPTIONS, index=SITE_OPTIONS.index(record['site_type']) if record['site_type'] in SITE_OPTIONS else 0)
+                    nup = st.number_input(CRM_COL_MAP['unit_price'], record['unit_price'])
+                    na = st.number_input(CRM_COL_MAP['area'], record['area'])
+                    nic = st.selectbox(CRM_COL_MAP['is_construction'], CONSTRUCTION_OPTIONS, index=CONSTRUCTION_OPTIONS.index(record['is_construction']))
+                    ncf = st.number_input(CRM_COL_MAP['construction_fee'], record['construction_fee'])
+                    nmf = st.number_input(CRM_COL_MAP['material_fee'], record['material_fee'])
+                    nsf = st.number_input(CRM_COL_MAP['shipping_fee'], record.get('shipping_fee', 0.0))
+
+                    if st.form_submit_button("更新"):
+                        udata = {
+                            'customer_name': nn, 'phone': nph, 'source': ns,
+                            'shop_name': nshop, 'unit_price': nup, 'area': na, 
+                            'site_type': nsite, 'is_construction': nic, 
+                            'construction_fee': ncf, 'material_fee': nmf, 'shipping_fee': nsf,
+                            'status': record['status'], 'purchase_intent': record['purchase_intent']
+                        }
+                        admin_update_data(u_id, udata)
+                        del st.session_state['edit_record']
+                        st.success("已更新")
+                        st.rerun()
+
+@st.fragment
+def _admin_maintenance_panel(current_user, current_display_name):
+    with st.expander("🚨 数据库维护工具"):
+        # 先预览再执行：执行时只修改预览中列出的记录 (并再次校验条件)
+        fix_key = st.selectbox("修复项", list(MAINTENANCE_FIXES), format_func=lambda k: MAINTENANCE_FIXES[k]['label'])
+        st.caption(f"圈定条件：{MAINTENANCE_FIXES[fix_key]['hint']}")
+        target_ids_text = st.text_input("只处理指定 ID (可选，逗号分隔)", key="maint_ids")
+        target_ids = [int(i) for i in re.findall(r'\d+', target_ids_text)] or None
+
+        if st.button("🔍 预览受影响记录 (不修改数据)"):
+            st.session_state['maint_preview'] = {'fix': fix_key, 'target': target_ids_text,
+                                                 'df': preview_maintenance(fix_key, target_ids)}
+        preview = st.session_state.get('maint_preview')
+        if preview and preview['fix'] == fix_key and preview['target'] == target_ids_text:
+            df_preview = preview['df']
+            if df_preview.empty:
+                st.success("没有符合条件的记录，无需修复。")
+            else:
+                st.warning(f"⚠️ 将修改以下 {len(df_preview)} 条记录：")
+                st.dataframe(df_preview, hide_index=True, use_container_width=True)
+                if st.button(f"🔥 确认修复这 {len(df_preview)} 条记录"):
+                    submit_job('maintenance', {'fix': fix_key, 'operator': current_display_name,
+                                               'record_ids': df_preview['id'].tolist()}, current_user)
+                    del st.session_state['maint_preview']
+                    st.rerun()
+
+        df_maint_log = get_maintenance_log()
+        if not df_maint_log.empty:
+            st.caption("最近的维护记录")
+            df_maint_log['fix'] = df_maint_log['fix'].map(lambda k: MAINTENANCE_FIXES.get(k, {}).get('label', k))
+            st.dataframe(df_maint_log.rename(columns={'fix': '修复项', 'operator': '操作人', 'performed_at': '时间',
+                                                      'rows': '修改行数', 'affected_ids': '修改的 ID'}),
+                         hide_index=True, use_container_width=True)
+
+        if st.button("📊 重建月度汇总表"):
+            submit_job('rebuild_rollup', {}, current_user)
+            st.rerun()
+
+        if st.button("🧮 客户数据内存占用"):
+            rows, df_mem = sales_memory_report()
+            total, plain_total = df_mem['bytes'].sum(), df_mem['plain_bytes'].sum()
+            st.info(f"共 {rows} 行，类型化读取后占用 {total / 1048576:.2f} MB "
+                    f"(分类列按字符串存储时为 {plain_total / 1048576:.2f} MB)")
+            st.dataframe(df_mem.rename(columns={'column': '列', 'dtype': '类型', 'bytes': '占用(字节)', 'plain_bytes': '字符串存储(字节)'}),
+                         hide_index=True, use_container_width=True)
+
+        if st.button("🧬 查找重复客户"):
+            df_dup = find_duplicate_clusters()
+            if df_dup.empty:
+                st.success("未发现重复客户。")
+            else:
+                st.warning(f"发现 {df_dup['cluster'].nunique()} 组疑似重复客户 (客户名或电话规范化后相同)，共 {len(df_dup)} 条记录：")
+                st.dataframe(df_dup.rename(columns={'cluster': '组号', **CRM_COL_MAP}), hide_index=True, use_container_width=True,
+                             column_config={"录入日期": st.column_config.DateColumn("录入日期")})
+
+@st.fragment
+def _promo_entry_panel():
+    with st.expander("➕ 录入推广数据 (按月/店铺/类型)"):
+        with st.form("promo_entry"):
+            col_p1, col_p2, col_p3 = st.columns(3)
+            with col_p1:
+                d_val = st.date_input("推广月份 (选择该月任意一天即可)", value=datetime.date.today())
+                p_month = d_val.strftime("%Y-%m") # 自动转换为 2023-10 格式
+                p_shop = st.selectbox("店铺", SHOP_OPTIONS)
+                p_type = st.selectbox("推广类型", PROMO_TYPE_OPTIONS)
+
+            with col_p2:
+                p_total_spend = st.number_input("总花费 (元)", min_value=0.0, step=10.0)
+                p_trans_spend = st.number_input("成交花费 (元)", min_value=0.0, step=10.0)
+                p_net_gmv = st.number_input("净成交额 (元)", min_value=0.0, step=100.0)
+                if p_total_spend > 0:
+                    calc_roi = p_net_gmv / p_total_spend
+                    st.caption(f"💡 自动计算净投产比(ROI): {calc_roi:.2f}")
+
+            with col_p3:
+                p_net_roi = st.number_input("净投产比 (ROI)", min_value=0.0, step=0.1)
+                p_cpa_net = st.number_input("每笔净成交花费 (元)", min_value=0.0, step=1.0)
+
+            st.markdown("---")
+            col_p4, col_p5, col_p6 = st.columns(3)
+            with col_p4:
+                p_inquiry_count = st.number_input("询单量", min_value=0, step=1)
+            with col_p5:
+                p_inquiry_spend = st.number_input("询单花费 (元)", min_value=0.0, step=10.0)
+            with col_p6:
+                p_cpl = st.number_input("询单成本 (元/个)", min_value=0.0, step=1.0)
+                if p_inquiry_count > 0:
+                     st.caption(f"💡 自动计算询单成本: {p_inquiry_spend/p_inquiry_count:.2f}")
+
+            p_note = st.text_area("备注及优化建议")
+
+            if st.form_submit_button("✅ 提交数据"):
+                add_promo_data((p_month, p_shop, p_type, p_total_spend, p_trans_spend, p_net_gmv, 
+                                p_net_roi, p_cpa_net, p_inquiry_count, p_inquiry_spend, p_cpl, p_note))
+                st.success(f"已录入 {p_month} 数据！")
+                st.rerun()
+
+    with st.expander("📥 批量导入推广数据 (Excel/CSV)"):
+        st.caption("表头使用导出文件中的中文列名 (或英文字段名)；月份可填 2024-05 或具体日期。")
+        promo_import_file = st.file_uploader("选择文件", type=['xlsx', 'csv'], key="promo_import_file")
+        if promo_import_file is not None and st.button("🚀 开始导入", key="promo_import_go"):
+            with st.spinner("正在导入..."):
+                st.session_state['promo_import_result'] = import_promotions(promo_import_file, promo_import_file.name)
+            # 导入改变了看板数据：整页刷新，导入结果在刷新后显示
+            st.rerun()
+        result = st.session_state.pop('promo_import_result', None)
+        if result:
+            render_import_result(result)
+
+@st.fragment
+def _promo_dashboard_panel():
+    # 汇总由 SQL 计算并按数据版本缓存
+    promo_dash = get_promo_dashboard()
+
+    if promo_dash['row_count'] > 0:
+        st.markdown("### 1. 核心指标月度趋势")
+        df_summary = promo_dash['monthly']
+        st.dataframe(df_summary.style.format({'整体ROI': '{:.2f}', '总花费(元)': '{:,.0f}', '净成交额(元)': '{:,.0f}'}), hide_index=True)
+
+        col_c1, col_c2 = st.columns(2)
+        with col_c1:
+            fig1 = px.bar(df_summary, x='月份', y=['净成交额(元)', '总花费(元)'], barmode='group', 
+                          title='投入产出对比 (GMV vs Cost)', labels={'value':'金额','variable':'指标'})
+            st.plotly_chart(fig1, use_container_width=True)
+
+        with col_c2:
+            fig2 = px.line(df_summary, x='月份', y='整体ROI', title='整体净投产比 (ROI) 趋势', markers=True)
+            st.plotly_chart(fig2, use_container_width=True)
+
+        st.markdown("### 2. 深度运营分析")
+        col_c3, col_c4 = st.columns(2)
+
+        with col_c3:
+            fig3 = px.bar(promo_dash['shop'], x='店铺', y='ROI', color='店铺', title='各店铺投产比 (ROI) 对比', text_auto='.2f')
+            st.plotly_chart(fig3, use_container_width=True)
+
+        with col_c4:
+            fig4 = px.line(promo_dash['cpl'], x='月份', y=['询单成本(元/个)', '加权询单成本(元/个)'], title='询单成本 (CPL) 趋势',
+                           markers=True, labels={'value': '元/个', 'variable': '指标'})
+            st.plotly_chart(fig4, use_container_width=True)
+            st.caption("询单成本为各条记录的简单平均；加权询单成本 = 询单花费合计 ÷ 询单量合计")
+
+        st.markdown("### 3. 推广归因 (按 CRM 实际线索与成交)")
+        df_attr = get_promo_attribution()
+        st.caption("按 月份 + 店铺 关联 CRM 中来源为对应推广渠道的客户：" +
+                   "、".join(f"{shop} → {channel}" for shop, channel in PROMO_SHOP_CHANNELS.items()) +
+                   f"。成交指进度为「{DEAL_STATUS}」，成交额不含运费。")
+        # 每月汇总只涉及 月份×店铺 级别的少量行
+        df_attr_month = df_attr[df_attr['客户来源'] != ''].groupby('月份')[['总花费(元)', '填报净成交额(元)', 'CRM成交额(元)']].sum()
+        if not df_attr_month.empty:
+            df_attr_month['填报ROI'] = df_attr_month['填报净成交额(元)'] / df_attr_month['总花费(元)'].where(df_attr_month['总花费(元)'] > 0)
+            df_attr_month['实际ROI'] = df_attr_month['CRM成交额(元)'] / df_attr_month['总花费(元)'].where(df_attr_month['总花费(元)'] > 0)
+            fig5 = px.line(df_attr_month.reset_index(), x='月份', y=['填报ROI', '实际ROI'], markers=True,
+                           title='填报 ROI 与 CRM 实际 ROI 对比 (有推广渠道的店铺)', labels={'value': 'ROI', 'variable': '指标'})
+            st.plotly_chart(fig5, use_container_width=True)
+        st.dataframe(df_attr.style.format({
+            '总花费(元)': '{:,.0f}', '填报净成交额(元)': '{:,.0f}', '填报ROI': '{:.2f}', 'CRM成交额(元)': '{:,.0f}',
+            '实际ROI': '{:.2f}', '每笔成交成本(元)': '{:,.0f}', '每条线索成本(元)': '{:,.1f}',
+        }, na_rep='-'), hide_index=True, use_container_width=True)
+
+        st.markdown("### 4. 数据明细表")
+        st.dataframe(get_promo_data(rename_cols=True), hide_index=True, use_container_width=True)
+    else:
+        st.info("暂无推广数据，请先录入。")
+
 # --- 主程序 ---
 def main():
     st.set_page_config(page_title="CRM运营全能版", layout="wide")
-    init_user_db()
-    init_db()
-    init_promo_db()
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        st.error(f"当前 Python 自带的 SQLite 版本为 {sqlite3.sqlite_version}，本系统需要 "
+                 f"{'.'.join(map(str, MIN_SQLITE_VERSION))} 及以上版本，请升级 Python (或 SQLite) 后重新启动。")
+        st.stop()
+    boot_info = bootstrap_databases()
 
     if check_password():
         user_role = st.session_state["role"]
@@ -342,6 +2326,9 @@ def main():
         user_map = get_user_map()
         
         st.sidebar.title(f"👤 {current_display_name}")
+        if user_role == 'admin':
+            schema_desc = ", ".join(f"{db}: v{v}" for db, v in boot_info['schema_versions'].items())
+            st.sidebar.caption(f"⏱️ 数据库初始化耗时 {boot_info['elapsed_ms']:.0f} ms ({schema_desc})")
         menu = ["📝 新增销售记录", "📊 数据追踪与查看", "📈 销售分析看板", "🌐 推广数据看板"]
         choice = st.sidebar.radio("菜单", menu)
         
@@ -349,37 +2336,20 @@ def main():
         st.sidebar.markdown("---")
         st.sidebar.markdown("### 💾 数据备份")
         
-        if st.sidebar.button("下载客户数据 (Excel)"):
-            # 获取原始英文列名数据
-            df_export = get_data(rename_cols=False) 
-            if not df_export.empty:
-                # 复制并重命名列，用于导出
-                df_export_cn = df_export.rename(columns=CRM_COL_MAP)
-                
-                # 导出时将对接人从 username 映射为中文名
-                df_export_cn['对接人'] = df_export_cn['对接人'].map(user_map).fillna(df_export_cn['对接人'])
-                
-                output = io.BytesIO()
-                # 计算一个"实际含运费总额"字段供参考
-                df_export_cn['实际含运费总额(元)'] = df_export_cn['预估总金额(元)'] + df_export_cn['运费(元)']
-                
-                with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                    df_export_cn.to_excel(writer, index=False, sheet_name='Sheet1')
-                excel_data = output.getvalue()
-                st.sidebar.download_button(label="📥 客户数据备份", data=excel_data, file_name=f'CRM_Customer_Backup_{datetime.date.today()}.xlsx', mime='application/vnd.ms-excel')
-            else:
-                st.sidebar.warning("暂无客户数据")
+        export_fmt = st.sidebar.selectbox("导出格式", list(EXPORT_FORMATS))
+        export_ext, export_mime = EXPORT_FORMATS[export_fmt]
+
+        # 导出在后台任务中执行，完成后在下方任务面板下载
+        if st.sidebar.button("下载客户数据"):
+            submit_job('export', {'table': 'sales', 'format': export_fmt, 'mime': export_mime,
+                                  'file_name': f'CRM_Customer_Backup_{datetime.date.today()}.{export_ext}'}, current_user)
         
-        if st.sidebar.button("下载推广数据 (Excel)"):
-            df_promo_export = get_promo_data(rename_cols=True) # 导出时使用中文列名
-            if not df_promo_export.empty:
-                output = io.BytesIO()
-                with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                    df_promo_export.to_excel(writer, index=False, sheet_name='Sheet1')
-                excel_data = output.getvalue()
-                st.sidebar.download_button(label="📥 推广数据备份", data=excel_data, file_name=f'CRM_Promo_Backup_{datetime.date.today()}.xlsx', mime='application/vnd.ms-excel')
-            else:
-                st.sidebar.warning("暂无推广数据")
+        if st.sidebar.button("下载推广数据"):
+            submit_job('export', {'table': 'promotions', 'format': export_fmt, 'mime': export_mime,
+                                  'file_name': f'CRM_Promo_Backup_{datetime.date.today()}.{export_ext}'}, current_user)
+
+        with st.sidebar:
+            render_job_panel(current_user)
 
 
         # 1. 新增记录页面
@@ -400,7 +2370,7 @@ def main():
                      area = st.number_input("平方数 (㎡)", min_value=0.0, step=0.1)
                  
                  with col3:
-                     is_const = st.selectbox("是否施工", ["否", "是"])
+                     is_const = st.selectbox("是否施工", CONSTRUCTION_OPTIONS)
                      const_fee = st.number_input("施工费 (元)", min_value=0.0, step=100.0)
                      mat_fee = st.number_input("辅料费用 (元)", min_value=0.0, step=50.0)
                      shipping_fee = st.number_input("运费 (元)", min_value=0.0, step=10.0)
@@ -435,257 +2405,46 @@ def main():
                              rep_display_name = user_map.get(existing_rep, existing_rep)
                              st.error(f"❌ 录入失败！该客户已存在，目前由 **{rep_display_name}** 负责。")
                          else:
-                             # 🚨 calc_total 不含运费
-                             calc_total = (unit_price * area) + const_fee + mat_fee
-                             log_entry = f"[{datetime.date.today()} {current_display_name}]: 首次录入。{first_remark}"
+                             # 总金额 (不含运费) 由数据库生成列计算
+                             log_entry = f"首次录入。{first_remark}"
                              
                              data_tuple = (
                                  date_val, current_user, customer_name, phone, source, shop_name, unit_price, area,
                                  site_type, status, is_const, const_fee, mat_fee, shipping_fee,
-                                 purchase_intent, calc_total, log_entry, sample_no, order_no,
+                                 purchase_intent, sample_no, order_no,
                                  str(last_fup), str(next_fup)
                              )
-                             add_data(data_tuple)
+                             add_data(data_tuple, log_entry, current_display_name)
                              st.success(f"🎉 客户 {customer_name} 录入成功！")
 
+             with st.expander("📥 批量导入客户 (Excel/CSV)"):
+                 st.caption("表头使用导出文件中的中文列名 (或英文字段名)；对接人留空则归到您名下 (非管理员只能导入自己负责的客户)，客户名称/电话与已有客户重复的行不会导入。")
+                 import_file = st.file_uploader("选择文件", type=['xlsx', 'csv'], key="sales_import_file")
+                 if import_file is not None and st.button("🚀 开始导入", key="sales_import_go"):
+                     with st.spinner("正在导入..."):
+                         result = import_sales(import_file, import_file.name, current_user, current_display_name, user_role, user_map)
+                     render_import_result(result)
+
 
         # 2. 数据查看页面 (重点修复区域)
         elif choice == "📊 数据追踪与查看":
              st.subheader("📋 客户追踪列表")
              
-             # 获取原始英文列名数据，然后立即转换为中文列名
-             df = get_data(rename_cols=True) 
-             
-             with st.expander("➕ 快速追加跟进记录"):
-                 col_up1, col_up2 = st.columns([1, 2])
-                 with col_up1:
-                     if not df.empty:
-                         # 这里的 df 已经使用了中文列名 '对接人'，但内容是 username
-                         df['中文对接人'] = df['对接人'].map(user_map).fillna(df['对接人'])
-                         customer_id_map = {f"{row['ID']} - {row['客户名称']} ({row['中文对接人']})": row['ID'] for index, row in df.iterrows()}
-                         selected_customer_label = st.selectbox("选择客户 ID 和名称", list(customer_id_map.keys()))
-                         up_id = customer_id_map.get(selected_customer_label, None)
-                     else:
-                         up_id = st.number_input("输入客户 ID", min_value=1, step=1)
-                 with col_up2:
-                     up_content = st.text_input("本次跟进情况")
-                 
-                 col_up3, col_up4, col_up5 = st.columns(3)
-                 with col_up3:
-                     up_next_date = st.date_input("下次跟进时间", datetime.date.today() + datetime.timedelta(days=3))
-                 with col_up4:
-                     up_status = st.selectbox("更新进度状态", STATUS_OPTIONS, key="up_stat")
-                 with col_up5:
-                     up_intent = st.selectbox("更新购买意向", INTENT_OPTIONS, key="up_int")
-                 
-                 if st.button("🚀 提交跟进更新"):
-                     if up_id is None:
-                          st.error("请先录入数据。")
-                     elif not df.empty and up_id in df['ID'].values: 
-                        # 获取原始 username (在 df 中仍是 username)
-                        record_rep_username = df[df['ID'] == up_id]['对接人'].values[0] 
-                        
-                        if user_role == 'admin' or record_rep_username == current_user:
-                            new_log = f"[{datetime.date.today()} {current_display_name}]: {up_content}"
-                            update_follow_up(up_id, new_log, str(up_next_date), up_status, up_intent)
-                            st.success("跟进记录已追加！")
-                            st.rerun()
-                        else:
-                            st.error("无权限操作非本人客户记录。")
-                     else:
-                         st.error("ID 不存在")
-
-             st.markdown("---")
-             
-             if not df.empty:
-                 # df 此时已经是中文列名
-                 df_show = df.copy()
-                 
-                 # 日期处理
-                 df_show['计划下次跟进'] = pd.to_datetime(df_show['计划下次跟进'], errors='coerce')
-                 df_show['上次跟进日期'] = pd.to_datetime(df_show['上次跟进日期'], errors='coerce')
-                 df_show['录入日期'] = pd.to_datetime(df_show['录入日期'], errors='coerce') 
-                 today = datetime.date.today()
-                 
-                 df_show['days_since_fup'] = (pd.to_datetime(today) - df_show['上次跟进日期']).dt.days
-                 
-                 # 映射 '对接人' 列内容为中文名 (如果需要筛选显示)
-                 df_show['中文对接人'] = df_show['对接人'].map(user_map).fillna(df_show['对接人'])
-                 
-                 # 超期转交逻辑
-                 overdue = df_show[(df_show['跟踪进度'] != '已完结/已收款') & (df_show['days_since_fup'] > DAYS_FOR_TRANSFER)]
-                 if user_role == 'admin' and not overdue.empty:
-                     st.error(f"⚠️ 管理员注意：有 {len(overdue)} 个客户超 {DAYS_FOR_TRANSFER} 天未跟进！")
-                     if st.button("🔥 一键接管所有超期客户"):
-                         # 必须使用原始ID进行转交
-                         overdue_ids = overdue['ID'].values
-                         for pid in overdue_ids:
-                             transfer_sales_rep(pid, 'admin')
-                         st.success("已全部转入管理员名下")
-                         st.rerun()
-
-                 # 提醒逻辑
-                 my_reminders = df_show[
-                     (df_show['计划下次跟进'].dt.date <= today) & 
-                     (df_show['跟踪进度'] != '已完结/已收款') &
-                     (df_show['中文对接人'] == current_display_name)
-                 ]
-                 if not my_reminders.empty:
-                     st.warning(f"🔔 {current_display_name}，您今天有 {len(my_reminders)} 个待办跟进！")
-
-                 col_filter_month, col_filter_rep, col_search = st.columns(3)
-                 
-                 with col_filter_month:
-                     df_show['录入年月'] = df_show['录入日期'].dt.strftime('%Y年%m月')
-                     month_options = ['全部月份'] + sorted(df_show['录入年月'].unique().tolist(), reverse=True)
-                     filter_month = st.selectbox("🗓️ 录入月份筛选", month_options)
-                     
-                 with col_filter_rep:
-                     rep_display_options = ['全部'] + list(user_map.values())
-                     filter_rep_display = st.selectbox("👤 对接人筛选", rep_display_options)
+             # 各区块为独立重跑的片段：提交跟进只刷新跟进区和提醒计数，改筛选只刷新客户列表
+             _follow_up_panel(user_role, current_user, current_display_name)
 
-                 with col_search:
-                     search_term = st.text_input("🔍 搜客户、电话或店铺")
-
-                 df_final = df_show.copy()
-                 
-                 if filter_month != '全部月份':
-                     df_final = df_final[df_final['录入年月'] == filter_month]
-                     
-                 if filter_rep_display != '全部':
-                     # 筛选基于中文名
-                     df_final = df_final[df_final['中文对接人'] == filter_rep_display]
-                 
-                 if search_term:
-                     df_final = df_final[
-                         df_final['客户名称'].astype(str).str.contains(search_term, case=False) |
-                         df_final['联系电话'].astype(str).str.contains(search_term, case=False) |
-                         df_final['店铺名称'].astype(str).str.contains(search_term, case=False)
-                     ]
-                 
-                 # 最终显示：使用中文对接人，但保留原始对接人字段（username）用于后台操作。
-                 # 将中文对接人覆盖到 '对接人' 列，用于显示。
-                 df_final['对接人'] = df_final['中文对接人']
-                 
-                 # 定义 Streamlit 列配置
-                 st_col_config = {
-                    "ID": st.column_config.NumberColumn("ID"),
-                    "录入日期": st.column_config.DateColumn("录入日期"),
-                    "对接人": st.column_config.TextColumn("👤 对接人"),
-                    "客户名称": st.column_config.TextColumn("客户名称"),
-                    "联系电话": st.column_config.TextColumn("联系电话"),
-                    "客户来源": st.column_config.TextColumn("客户来源"),
-                    "店铺名称": st.column_config.TextColumn("店铺名称"),
-                    "单价(元/㎡)": st.column_config.NumberColumn("单价(元/㎡)", format="%.2f"),
-                    "平方数(㎡)": st.column_config.NumberColumn("平方数(㎡)", format="%.2f"),
-                    "应用场地": st.column_config.TextColumn("应用场地"),
-                    "跟踪进度": st.column_config.TextColumn("跟踪进度"),
-                    "是否施工": st.column_config.TextColumn("是否施工"),
-                    "施工费(元)": st.column_config.NumberColumn("施工费(元)", format="%.2f"),
-                    "辅料费(元)": st.column_config.NumberColumn("辅料费(元)", format="%.2f"),
-                    "运费(元)": st.column_config.NumberColumn("运费(元)", format="%.2f"), # 运费单独列
-                    "购买意向": st.column_config.TextColumn("购买意向"),
-                    "预估总金额(元)": st.column_config.NumberColumn("预估总金额(元)", format="¥%.2f", help="不含运费的总金额"), 
-                    "寄样单号": st.column_config.TextColumn("寄样单号"),
-                    "订单号": st.column_config.TextColumn("订单号"),
-                    "跟进历史": st.column_config.TextColumn("📜 跟进历史", width="large"),
-                    "上次跟进日期": st.column_config.DateColumn("上次跟进"),
-                    "计划下次跟进": st.column_config.DateColumn("计划下次"),
-                    "days_since_fup": None, # 隐藏计算列
-                    "录入年月": None, # 隐藏计算列
-                    "中文对接人": None # 隐藏计算列
-                 }
-                 
-                 # 确保只选择 CRM_COL_MAP 中定义的中文列名 (以及可能新增的中文对接人，但这里将其隐藏了)
-                 display_cols = list(CRM_COL_MAP.values()) 
-                 df_display = df_final[[c for c in display_cols if c in df_final.columns]].copy()
-
-                 # 🚨 最终显示
-                 st.dataframe(
-                     df_display,
-                     hide_index=True, 
-                     use_container_width=True,
-                     column_config=st_col_config
-                 )
+             if get_follow_up_reminders()['total'] > 0:
+                 _sales_grid_panel(user_map)
 
                  # --- 管理员功能区 ---
                  if user_role == 'admin':
                      st.markdown("---")
                      st.subheader("🛠️ 管理员操作区")
-                     
-                     col_user, col_del, col_edit = st.columns(3)
-                     
-                     with col_user:
-                         with st.expander("👤 用户管理"):
-                             with st.form("add_user"):
-                                 nu = st.text_input("用户名")
-                                 npw = st.text_input("密码", type="password")
-                                 ndn = st.text_input("中文名")
-                                 nr = st.selectbox("角色", ['user', 'admin'])
-                                 if st.form_submit_button("添加"):
-                                     if add_new_user(nu, npw, nr, ndn):
-                                         st.success("成功")
-                                         st.rerun()
-                                     else: st.error("失败")
-                             st.dataframe(get_all_users(), hide_index=True)
-
-                     with col_del:
-                         with st.expander("🗑️ 删除记录"):
-                             d_id = st.number_input("ID", min_value=1, key="del_id")
-                             if st.button("删除"):
-                                 delete_data(d_id)
-                                 st.success("已删除")
-                                 st.rerun()
-
-                     with col_edit:
-                         with st.expander("📝 修改基本信息(不含运费)"):
-                             u_id = st.number_input("ID", min_value=1, key="edit_id")
-                             if st.button("加载"):
-                                 record = get_single_record(u_id) # 获取的是英文列名数据
-                                 if record: 
-                                     st.session_state['edit_record'] = record
-                                     st.success("记录已加载，请修改并提交。")
-                                 else: st.error("不存在")
-                             
-                             # 注意：这里 record['key'] 依然是英文数据库列名
-                             if 'edit_record' in st.session_state and st.session_state['edit_record']['id'] == u_id:
-                                 record = st.session_state['edit_record']
-                                 with st.form("admin_edit"):
-                                     nn = st.text_input("客户名", record['customer_name'])
-                                     nph = st.text_input("电话", record['phone'])
-                                     # 使用中文名作为 key，方便理解
-                                     ns = st.selectbox(CRM_COL_MAP['source'], SOURCE_OPTIONS, index=SOURCE_OPTIONS.index(record['source']) if record['source'] in SOURCE_OPTIONS else 0)
-                                     nshop = st.selectbox(CRM_COL_MAP['shop_name'], SHOP_OPTIONS, index=SHOP_OPTIONS.index(record['shop_name']) if record['shop_name'] in SHOP_OPTIONS else 0)
-                                     nsite = st.selectbox(CRM_COL_MAP['site_type'], SITE_OPTIONS, index=SITE_OPTIONS.index(record['site_type']) if record['site_type'] in SITE_OPTIONS else 0)
-                                     nup = st.number_input(CRM_COL_MAP['unit_price'], record['unit_price'])
-                                     na = st.number_input(CRM_COL_MAP['area'], record['area'])
-                                     nic = st.selectbox(CRM_COL_MAP['is_construction'], ["否","是"], index=["否","是"].index(record['is_construction']))
-                                     ncf = st.number_input(CRM_COL_MAP['construction_fee'], record['construction_fee'])
-                                     nmf = st.number_input(CRM_COL_MAP['material_fee'], record['material_fee'])
-                                     nsf = st.number_input(CRM_COL_MAP['shipping_fee'], record.get('shipping_fee', 0.0))
-                                     
-                                     if st.form_submit_button("更新"):
-                                         udata = {
-                                             'customer_name': nn, 'phone': nph, 'source': ns,
-                                             'shop_name': nshop, 'unit_price': nup, 'area': na, 
-                                             'site_type': nsite, 'is_construction': nic, 
-                                             'construction_fee': ncf, 'material_fee': nmf, 'shipping_fee': nsf,
-                                             'status': record['status'], 'purchase_intent': record['purchase_intent']
-                                         }
-                                         admin_update_data(u_id, udata)
-                                         del st.session_state['edit_record']
-                                         st.success("已更新")
-                                         st.rerun()
+                     _admin_record_panel()
                      
                      # --- 修复功能 ---
                      st.markdown("---")
-                     with st.expander("🚨 数据库维护工具"):
-                         if st.button("🔄 修复单价/面积数据互换 (所有记录)"):
-                             st.warning("⚠️ 警告：此操作将批量交换所有记录的单价和面积，并重算总金额（不含运费）。请确认执行！")
-                             if st.button("🔥 确认执行修复操作"):
-                                 rows = admin_fix_area_price_swap()
-                                 st.success(f"🎉 修复完成！共影响 {rows} 条记录的单价、面积和总金额（不含运费）。")
-                                 st.rerun()
+                     _admin_maintenance_panel(current_user, current_display_name)
 
         # 3. 销售分析页面 
         elif choice == "📈 销售分析看板":
@@ -697,50 +2456,36 @@ def main():
             # 🚨 新增面积目标
             target_area = st.sidebar.number_input("📐 本月面积目标 (㎡)", min_value=100.0, value=500.0, step=10.0, key="target_area")
             
-            # 获取数据并转换为中文列名
-            df = get_data(rename_cols=True) 
-            
-            if not df.empty:
-                # 使用中文列名进行数值和日期处理
-                df['预估总金额(元)'] = pd.to_numeric(df['预估总金额(元)'], errors='coerce').fillna(0)
-                df['运费(元)'] = pd.to_numeric(df['运费(元)'], errors='coerce').fillna(0)
-                df['施工费(元)'] = pd.to_numeric(df['施工费(元)'], errors='coerce').fillna(0)
-                df['辅料费(元)'] = pd.to_numeric(df['辅料费(元)'], errors='coerce').fillna(0)
-                df['平方数(㎡)'] = pd.to_numeric(df['平方数(㎡)'], errors='coerce').fillna(0)
-                
-                # 毛利计算 (🚨 总金额不含运费，所以毛利 = 总金额 - 施工费 - 辅料费)
-                df['毛利'] = df['预估总金额(元)'] - df['施工费(元)'] - df['辅料费(元)'] 
-                df['录入日期'] = pd.to_datetime(df['录入日期'], errors='coerce')
-                df['月度'] = df['录入日期'].dt.strftime('%Y-%m')
-                
-                # 映射 '对接人' 列内容为中文名
-                df['对接人'] = df['对接人'].map(user_map).fillna(df['对接人'])
+            # 所有指标由 SQL 聚合得到，并按数据版本缓存；页面只处理几十行的汇总结果
+            current_month = datetime.date.today().strftime('%Y-%m')
+            dashboard = get_sales_dashboard(current_month)
+            totals = dashboard['totals']
 
+            if totals['leads'] > 0:
                 # --- 核心KPI ---
-                current_month = datetime.date.today().strftime('%Y-%m')
-                monthly_sales = df[df['月度'] == current_month]['预估总金额(元)'].sum()
-                monthly_area = df[df['月度'] == current_month]['平方数(㎡)'].sum() 
-
-                
-                c1, c2, c3, c4, c5, c6 = st.columns(6) 
-                c1.metric("💰 总销售额(不含运)", f"¥{df['预估总金额(元)'].sum():,.0f}")
-                c2.metric("📈 总体毛利", f"¥{df['毛利'].sum():,.0f}", help="销售额(不含运费) - 施工费 - 辅料费")
-                c3.metric("📏 总销售面积", f"{df['平方数(㎡)'].sum():,.0f} ㎡") 
-                c4.metric("🚚 总运费", f"¥{df['运费(元)'].sum():,.0f}") 
+                monthly_sales = totals['month_revenue']
+                monthly_area = totals['month_area']
+
+
+                c1, c2, c3, c4, c5, c6 = st.columns(6)
+                c1.metric("💰 总销售额(不含运)", f"¥{totals['revenue']:,.0f}")
+                c2.metric("📈 总体毛利", f"¥{totals['margin']:,.0f}", help="销售额(不含运费) - 施工费 - 辅料费")
+                c3.metric("📏 总销售面积", f"{totals['area']:,.0f} ㎡")
+                c4.metric("🚚 总运费", f"¥{totals['shipping']:,.0f}")
                 c5.metric("📅 本月销售额", f"¥{monthly_sales:,.0f}", delta=f"{monthly_sales - target_revenue:,.0f} (距目标)")
-                c6.metric("📐 本月销售面积", f"{monthly_area:,.0f} ㎡", delta=f"{monthly_area - target_area:,.0f} (距目标)") 
+                c6.metric("📐 本月销售面积", f"{monthly_area:,.0f} ㎡", delta=f"{monthly_area - target_area:,.0f} (距目标)")
 
                 # --- 业绩达成进度条 ---
                 st.write(f"**本月目标达成率 ({current_month})**")
-                
+
                 col_prog1, col_prog2 = st.columns(2)
-                
+
                 with col_prog1:
                     st.caption("金额目标达成率:")
                     progress_rev = min(monthly_sales / target_revenue, 1.0)
                     st.progress(progress_rev)
                     st.caption(f"目标: ¥{target_revenue:,.0f} | 当前: ¥{monthly_sales:,.0f} ({progress_rev*100:.1f}%)")
-                
+
                 with col_prog2:
                     st.caption("面积目标达成率:")
                     progress_area = min(monthly_area / target_area, 1.0)
@@ -749,19 +2494,13 @@ def main():
 
 
                 st.markdown("---")
-                
+
                 # --- 销售龙虎榜 (基于实际成交金额) ---
-                st.markdown("### 🏆 销售龙虎榜 (本月成交金额 - 不含运费)") 
-                
-                df_achieved = df[df['跟踪进度'] == '已完结/已收款'].copy()
-                df_achieved['成交月'] = df_achieved['录入日期'].dt.strftime('%Y-%m')
-                
-                monthly_leaderboard = df_achieved[df_achieved['成交月'] == current_month]
-                
-                if not monthly_leaderboard.empty:
-                    # 分组时使用中文名列
-                    leaderboard_data = monthly_leaderboard.groupby('对接人')['预估总金额(元)'].sum().reset_index()
-                    leaderboard_data = leaderboard_data.sort_values('预估总金额(元)', ascending=False)
+                st.markdown("### 🏆 销售龙虎榜 (本月成交金额 - 不含运费)")
+
+                leaderboard_data = dashboard['leaderboard']
+
+                if not leaderboard_data.empty:
                     leaderboard_data.columns = ['👤 对接人', '💰 成交总额 (元)']
 
                     st.dataframe(
@@ -771,41 +2510,37 @@ def main():
                     )
                 else:
                     st.info("本月暂无已完结/已收款的成交记录。")
-                
+
                 st.markdown("---")
 
 
                 # --- 第一排：趋势与利润 ---
                 col_row1_1, col_row1_2 = st.columns(2)
-                
+                monthly_trend = dashboard['monthly']
+
                 with col_row1_1:
                     # 1. 销售额(不含运)与毛利趋势
-                    monthly_trend = df.groupby('月度')[['预估总金额(元)', '毛利']].sum().reset_index()
-                    fig_trend = px.line(monthly_trend, x='月度', y=['预估总金额(元)', '毛利'], markers=True, 
+                    fig_trend = px.line(monthly_trend, x='月度', y=['预估总金额(元)', '毛利'], markers=True,
                                         title="📈 月度销售额(不含运费)与毛利趋势", labels={'value':'金额', '月度':'月份', 'variable':'指标'})
                     st.plotly_chart(fig_trend, use_container_width=True)
-                
+
                 with col_row1_2:
                     # 2. 月度销售面积趋势图
-                    monthly_area_trend = df.groupby('月度')['平方数(㎡)'].sum().reset_index()
-                    fig_area = px.bar(monthly_area_trend, x='月度', y='平方数(㎡)', text_auto='.0f',
+                    fig_area = px.bar(monthly_trend, x='月度', y='平方数(㎡)', text_auto='.0f',
                                       title="📐 月度销售面积趋势 (㎡)", labels={'平方数(㎡)':'面积(㎡)', '月度':'月份'})
                     st.plotly_chart(fig_area, use_container_width=True)
 
                 # --- 第二排：渠道与场地 ---
                 col_row2_1, col_row2_2 = st.columns(2)
-                
+
                 with col_row2_1:
-                    # 使用中文列名 (预估总金额不含运费)
-                    shop_perf = df.groupby('店铺名称')['预估总金额(元)'].sum().reset_index().sort_values('预估总金额(元)', ascending=False)
-                    fig_shop = px.bar(shop_perf, x='店铺名称', y='预估总金额(元)', text_auto='.2s', 
+                    # 预估总金额不含运费
+                    fig_shop = px.bar(dashboard['shop_perf'], x='店铺名称', y='预估总金额(元)', text_auto='.2s',
                                       title="🏪 各店铺业绩对比 (金额 - 不含运)", color='店铺名称')
                     st.plotly_chart(fig_shop, use_container_width=True)
 
                 with col_row2_2:
-                    # 使用中文列名
-                    site_perf = df.groupby('应用场地')['平方数(㎡)'].sum().reset_index().sort_values('平方数(㎡)', ascending=False).head(10)
-                    fig_site = px.bar(site_perf, y='应用场地', x='平方数(㎡)', orientation='h', text_auto='.2s',
+                    fig_site = px.bar(dashboard['site_perf'], y='应用场地', x='平方数(㎡)', orientation='h', text_auto='.2s',
                                       title="🏟️ Top 10 销售场地类型 (面积)", color_discrete_sequence=px.colors.qualitative.Pastel)
                     st.plotly_chart(fig_site, use_container_width=True)
 
@@ -813,9 +2548,7 @@ def main():
                 col_row3_1, col_row3_2 = st.columns(2)
 
                 with col_row3_1:
-                    # 使用中文列名
-                    status_counts = df['跟踪进度'].value_counts().reset_index()
-                    status_counts.columns = ['status', 'count']
+                    status_counts = dashboard['status_counts']
                     sorter = STATUS_OPTIONS
                     status_counts['status'] = pd.Categorical(status_counts['status'], categories=sorter, ordered=True)
                     status_counts = status_counts.sort_values('status')
@@ -823,10 +2556,8 @@ def main():
                     st.plotly_chart(fig_funnel, use_container_width=True)
 
                 with col_row3_2:
-                    # 使用中文列名
-                    if '客户来源' in df.columns:
-                        src_counts = df['客户来源'].value_counts().reset_index()
-                        src_counts.columns = ['source', 'count']
+                    src_counts = dashboard['source_counts']
+                    if not src_counts.empty:
                         fig_src = px.pie(src_counts, values='count', names='source', title="🌍 客户来源分布", hole=0.4)
                         st.plotly_chart(fig_src, use_container_width=True)
 
@@ -837,95 +2568,11 @@ def main():
         elif choice == "🌐 推广数据看板":
             st.subheader("🌐 线上推广效果深度分析")
             
-            df_promo = get_promo_data(rename_cols=True) # 获取中文列名数据
-            
-            with st.expander("➕ 录入推广数据 (按月/店铺/类型)"):
-                with st.form("promo_entry"):
-                    col_p1, col_p2, col_p3 = st.columns(3)
-                    with col_p1:
-                        d_val = st.date_input("推广月份 (选择该月任意一天即可)", value=datetime.date.today())
-                        p_month = d_val.strftime("%Y-%m") # 自动转换为 2023-10 格式
-                        p_shop = st.selectbox("店铺", SHOP_OPTIONS)
-                        p_type = st.selectbox("推广类型", PROMO_TYPE_OPTIONS)
-                    
-                    with col_p2:
-                        p_total_spend = st.number_input("总花费 (元)", min_value=0.0, step=10.0)
-                        p_trans_spend = st.number_input("成交花费 (元)", min_value=0.0, step=10.0)
-                        p_net_gmv = st.number_input("净成交额 (元)", min_value=0.0, step=100.0)
-                        if p_total_spend > 0:
-                            calc_roi = p_net_gmv / p_total_spend
-                            st.caption(f"💡 自动计算净投产比(ROI): {calc_roi:.2f}")
-                    
-                    with col_p3:
-                        p_net_roi = st.number_input("净投产比 (ROI)", min_value=0.0, step=0.1)
-                        p_cpa_net = st.number_input("每笔净成交花费 (元)", min_value=0.0, step=1.0)
-                    
-                    st.markdown("---")
-                    col_p4, col_p5, col_p6 = st.columns(3)
-                    with col_p4:
-                        p_inquiry_count = st.number_input("询单量", min_value=0, step=1)
-                    with col_p5:
-                        p_inquiry_spend = st.number_input("询单花费 (元)", min_value=0.0, step=10.0)
-                    with col_p6:
-                        p_cpl = st.number_input("询单成本 (元/个)", min_value=0.0, step=1.0)
-                        if p_inquiry_count > 0:
-                             st.caption(f"💡 自动计算询单成本: {p_inquiry_spend/p_inquiry_count:.2f}")
-                    
-                    p_note = st.text_area("备注及优化建议")
-                    
-                    if st.form_submit_button("✅ 提交数据"):
-                        add_promo_data((p_month, p_shop, p_type, p_total_spend, p_trans_spend, p_net_gmv, 
-                                        p_net_roi, p_cpa_net, p_inquiry_count, p_inquiry_spend, p_cpl, p_note))
-                        st.success(f"已录入 {p_month} 数据！")
-                        st.rerun()
+            _promo_entry_panel()
 
             st.markdown("---")
 
-            if not df_promo.empty:
-                # df_promo 此时已经是中文列名
-                num_cols = ['总花费(元)', '成交花费(元)', '净成交额(元)', '净投产比(ROI)', '每笔净成交花费(元)', '询单花费(元)', '询单成本(元/个)']
-                for c in num_cols: df_promo[c] = pd.to_numeric(df_promo[c], errors='coerce').fillna(0)
-                df_promo['询单量'] = pd.to_numeric(df_promo['询单量'], errors='coerce').fillna(0).astype(int)
-
-                st.markdown("### 1. 核心指标月度趋势")
-                df_summary = df_promo.groupby('月份').agg({
-                    '总花费(元)': 'sum',
-                    '净成交额(元)': 'sum',
-                    '询单量': 'sum'
-                }).reset_index().sort_values('月份')
-                
-                df_summary['整体ROI'] = np.where(df_summary['总花费(元)']>0, df_summary['净成交额(元)']/df_summary['总花费(元)'], 0)
-                st.dataframe(df_summary.style.format({'整体ROI': '{:.2f}', '总花费(元)': '{:,.0f}', '净成交额(元)': '{:,.0f}'}), hide_index=True)
-
-                col_c1, col_c2 = st.columns(2)
-                with col_c1:
-                    fig1 = px.bar(df_summary, x='月份', y=['净成交额(元)', '总花费(元)'], barmode='group', 
-                                  title='投入产出对比 (GMV vs Cost)', labels={'value':'金额','variable':'指标'})
-                    st.plotly_chart(fig1, use_container_width=True)
-                
-                with col_c2:
-                    fig2 = px.line(df_summary, x='月份', y='整体ROI', title='整体净投产比 (ROI) 趋势', markers=True)
-                    st.plotly_chart(fig2, use_container_width=True)
-
-                st.markdown("### 2. 深度运营分析")
-                col_c3, col_c4 = st.columns(2)
-                
-                with col_c3:
-                    df_shop = df_promo.groupby('店铺').agg({'总花费(元)':'sum', '净成交额(元)':'sum'}).reset_index()
-                    df_shop['ROI'] = np.where(df_shop['总花费(元)']>0, df_shop['净成交额(元)']/df_shop['总花费(元)'], 0)
-                    fig3 = px.bar(df_shop, x='店铺', y='ROI', color='店铺', title='各店铺投产比 (ROI) 对比', text_auto='.2f')
-                    st.plotly_chart(fig3, use_container_width=True)
-                
-                with col_c4:
-                    df_cpl = df_promo.groupby('月份')['询单成本(元/个)'].mean().reset_index()
-                    fig4 = px.line(df_cpl, x='月份', y='询单成本(元/个)', title='平均询单成本 (CPL) 趋势', markers=True)
-                    st.plotly_chart(fig4, use_container_width=True)
-
-                st.markdown("### 3. 数据明细表")
-                st.dataframe(df_promo, hide_index=True, use_container_width=True)
-                
-            else:
-                st.info("暂无推广数据，请先录入。")
+            _promo_dashboard_panel()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file